@@ -39,6 +39,9 @@ def run():
     parser.add_argument("--watch", action="store_true", help="Run in watch mode")
     parser.add_argument("--verbose", action="store_true", help="Verbose output - show all info messages.")
     parser.add_argument("--silent", action="store_true", help="Silent output - don't show errors.")
+    parser.add_argument("--incremental", action="store_true", help="Process only files changed since the previous run.")
+    parser.add_argument("--sync", action="store_true", help="Keep unchanged files in target directory instead of wiping it out.")
+    parser.add_argument("--jobs", type=int, help="Number of worker processes (default: number of CPUs).")
 
     args = parser.parse_args()
 
@@ -66,6 +69,17 @@ def run():
         log.info("Watch mode enabled.")
         watch_mode = True
  
+    if args.incremental:
+        Config.incremental = True
+
+    if args.sync:
+        Config.sync = True
+
+    if args.jobs != None:
+        if args.jobs < 1:
+            log.fatal("--jobs has to be a positive number")
+        Config.jobs = args.jobs
+
     log.info(f"Loading config...")
     Config.load_config(working_dir=working_dir, config_path=config_file)
  
@@ -0,0 +1,102 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+from .file_system import list_files_recursive, read_source_file, create_file_with_spans, is_binary_file, copy_file
+from .processor import compile_file
+from .context import Context
+from .log import log
+import asyncio
+
+
+class FileResult:
+    """
+        Result of processing of a single file by the async API.
+        error is None if the file was processed and written successfully.
+    """
+
+    def __init__(self, src_path, target_path, error = None):
+        self.src_path = src_path
+        self.target_path = target_path
+        self.error = error
+
+
+def make_context(defines):
+    """
+        :param defines: names of defined variables, or dictionary of global variables, or Context
+    """
+    if isinstance(defines, Context):
+        return defines
+    if isinstance(defines, dict):
+        return Context(dict(defines))
+    return Context({name: True for name in (defines or [])})
+
+
+def process_file_sync(src_path, target_path, base_context):
+    if is_binary_file(src_path):
+        if not copy_file(src_path, target_path):
+            raise IOError(f"Cannot copy '{src_path}' to '{target_path}'")
+        return
+    # bytes, the same as run_full - any encoding and line ends are kept
+    content = read_source_file(src_path)
+    file_context = base_context.new_file_context(src_path, src_path)
+    spans = compile_file(content).evaluate(file_context)
+    file_context.on_file_end()
+    if not create_file_with_spans(target_path, content, spans):
+        raise IOError(f"Cannot write '{target_path}'")
+
+
+async def process_file(src_path, target_path, defines = None):
+    """
+        Preprocess a single file without blocking the event loop - reading, processing and writing run in a worker thread.
+
+        :param src_path: path to the source file
+        :param target_path: path to the output file, missing directories are created
+        :param defines: names of defined variables, or dictionary of global variables, or Context
+        :return: FileResult
+    """
+    try:
+        await asyncio.to_thread(process_file_sync, src_path, target_path, make_context(defines))
+    except Exception as e:
+        log.error(f"Async processing of '{src_path}' failed: {str(e)}")
+        return FileResult(src_path, target_path, str(e))
+    return FileResult(src_path, target_path)
+
+
+async def process_tree(src_dir, target_dir, defines = None):
+    """
+        Preprocess all files in src_dir into target_dir, one file at a time, yielding to the event loop between files.
+        Use as async iterator - result of each file is yielded as soon as it is written:
+
+            async for result in process_tree("in", "out", ["PROD"]):
+                print(result.src_path, result.error)
+
+        Cancelling the consuming task stops processing before the next file.
+        Unlike run_full, target_dir is not wiped out.
+
+        :param defines: names of defined variables, or dictionary of global variables, or Context
+    """
+    base_context = make_context(defines)
+    files = await asyncio.to_thread(lambda: list(list_files_recursive(src_dir)))
+    for file_path, relative_path in files:
+        yield await process_file(file_path, target_dir + relative_path, base_context)
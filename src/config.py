@@ -22,16 +22,48 @@
 
 
 from .log import log
-from .context import context
+from .context import Context, context
+from .path_filter import load_path_filter
 import json
 import os
 import re
 
 
+class Variant:
+    """
+        One output of the build - its own target directory and its own context with global variables.
+        All variants are built from a single read of the source directory.
+    """
+
+    def __init__(self, name, target_dir, context):
+        self.name = name
+        self.target_dir = target_dir
+        self.context = context
+
+
 class Config:
     src_dir = ""
     target_dir = ""
     working_dir = "./"
+    variants = []
+    jobs = os.cpu_count() or 1
+    read_threads = 4
+    write_threads = 1
+    crawl_threads = 8
+    max_in_flight_bytes = 64 * 1024 * 1024
+    stream_threshold = 256 * 1024 * 1024
+    mmap = False
+    incremental = False
+    sync = False
+    unchanged_output = "write"
+    path_filter = None
+    manifest_path = os.path.join(".praprocessor", "manifest.json")
+    watch_backend = "auto"
+    poll_interval = 1.0
+    watch_debounce = 0.05
+    watch_max_delay = 1.0
+    cache_dir = None
+    cache_max_bytes = 512 * 1024 * 1024
 
     def load_config(working_dir, config_path):
         log.info(f"Setting working dir to {working_dir}")
@@ -44,7 +76,8 @@ class Config:
                 config = json.load(file)
             
                 Config.src_dir = os.path.join(working_dir, config['src_dir'])
-                Config.target_dir = os.path.join(working_dir, config['target_dir'])
+                if 'variants' not in config:
+                    Config.target_dir = os.path.join(working_dir, config['target_dir'])
                 
                 log.info(f"Source directory: {Config.src_dir}")
                 log.info(f"Target directory: {Config.target_dir}")
@@ -56,6 +89,58 @@ class Config:
                     Config.assert_define_values(define_values)
                     Config.add_defines_to_global_context(define_values)
 
+                for key in ['read_threads', 'write_threads', 'crawl_threads', 'max_in_flight_bytes', 'stream_threshold', 'cache_max_bytes']:
+                    if key in config:
+                        if not isinstance(config[key], int) or isinstance(config[key], bool) or config[key] < 1:
+                            log.fatal(f"{key} must be a positive integer - wrong value in configuration file")
+                        setattr(Config, key, config[key])
+
+                if 'incremental' in config:
+                    if not isinstance(config['incremental'], bool):
+                        log.fatal("incremental must be true or false - wrong value in configuration file")
+                    Config.incremental = Config.incremental or config['incremental']
+                if 'sync' in config:
+                    if not isinstance(config['sync'], bool):
+                        log.fatal("sync must be true or false - wrong value in configuration file")
+                    Config.sync = Config.sync or config['sync']
+                if 'mmap' in config:
+                    if not isinstance(config['mmap'], bool):
+                        log.fatal("mmap must be true or false - wrong value in configuration file")
+                    Config.mmap = config['mmap']
+                if 'unchanged_output' in config:
+                    if config['unchanged_output'] not in ["write", "copy", "hardlink", "reflink"]:
+                        log.fatal("unchanged_output must be one of 'write', 'copy', 'hardlink', 'reflink' - wrong value in configuration file")
+                    Config.unchanged_output = config['unchanged_output']
+                Config.manifest_path = os.path.join(working_dir, config.get('manifest', os.path.join(".praprocessor", "manifest.json")))
+                if 'cache_dir' in config:
+                    Config.cache_dir = os.path.join(working_dir, os.path.expanduser(config['cache_dir']))
+
+                if 'watch_backend' in config:
+                    if config['watch_backend'] not in ["auto", "inotify", "poll"]:
+                        log.fatal("watch_backend must be one of 'auto', 'inotify', 'poll' - wrong value in configuration file")
+                    Config.watch_backend = config['watch_backend']
+                if 'poll_interval' in config:
+                    if not isinstance(config['poll_interval'], (int, float)) or isinstance(config['poll_interval'], bool) or config['poll_interval'] <= 0:
+                        log.fatal("poll_interval must be a positive number of seconds - wrong value in configuration file")
+                    Config.poll_interval = config['poll_interval']
+                for key in ['watch_debounce', 'watch_max_delay']:
+                    if key in config:
+                        if not isinstance(config[key], (int, float)) or isinstance(config[key], bool) or config[key] < 0:
+                            log.fatal(f"{key} must be a non negative number of seconds - wrong value in configuration file")
+                        setattr(Config, key, config[key])
+
+                for key in ['include', 'exclude']:
+                    if key in config and (not isinstance(config[key], list) or not all(isinstance(pattern, str) for pattern in config[key])):
+                        log.fatal(f"{key} must be an array of glob patterns - wrong value in configuration file")
+                if 'gitignore' in config and not isinstance(config['gitignore'], bool):
+                    log.fatal("gitignore must be true or false - wrong value in configuration file")
+                Config.path_filter = load_path_filter(Config.src_dir, config.get('include'), config.get('exclude'), config.get('gitignore', False))
+
+                if 'variants' in config:
+                    Config.load_variants(working_dir, config['variants'])
+                else:
+                    Config.variants = [Variant("", Config.target_dir, context)]
+
         except FileNotFoundError:
             log.fatal(f"The file '{config_path}' was not found.")
         except json.JSONDecodeError:
@@ -65,11 +150,45 @@ class Config:
 
         # todo check if src_dir and target_dir are proper directories
 
-        if Config.src_dir == "" or Config.target_dir == "":
+        if Config.src_dir == "":
             log.fatal("Both src_dir and target_dir have to be properly specified to work safely")
 
-        if Config.src_dir == Config.target_dir:
-            log.fatal("src_dir and target_dir cannot be the same")
+        target_dirs = [variant.target_dir for variant in Config.variants]
+        for target_dir in target_dirs:
+            if target_dir == "":
+                log.fatal("Both src_dir and target_dir have to be properly specified to work safely")
+            if os.path.normpath(Config.src_dir) == os.path.normpath(target_dir):
+                log.fatal("src_dir and target_dir cannot be the same")
+        if len(set(os.path.normpath(target_dir) for target_dir in target_dirs)) != len(target_dirs):
+            log.fatal("Each variant has to have its own target_dir")
+
+
+    def load_variants(working_dir, variants):
+        if not isinstance(variants, list) or not variants:
+            log.fatal("variants must be a non empty array - wrong value in configuration file")
+        Config.variants = []
+        names = set()
+        for variant in variants:
+            if not isinstance(variant, dict):
+                log.fatal(f"Variant '{variant}' inside config file is not an object")
+            name = variant['name']
+            if not isinstance(name, str) or name == "" or name in names:
+                log.fatal(f"Variant name '{name}' inside config file has to be a unique non empty string")
+            names.add(name)
+
+            define_values = variant.get('#define', [])
+            if not isinstance(define_values, list):
+                log.fatal(f"#define of variant '{name}' must be an array - wrong value in configuration file")
+            Config.assert_define_values(define_values)
+
+            # global defines from the top of the config are shared by all variants
+            global_context = dict(context.global_context)
+            for var in define_values:
+                global_context[var] = True
+
+            target_dir = os.path.join(working_dir, variant['target_dir'])
+            log.info(f"Variant '{name}': target directory {target_dir}, defines {define_values}")
+            Config.variants.append(Variant(name, target_dir, Context(global_context)))
 
 
     def assert_define_values(values):
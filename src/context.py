@@ -21,52 +21,115 @@
 # SOFTWARE.
 
 
-from .log import log
+from .log import log, INFO
+from types import MappingProxyType
 
 class Context:
-    # todo this is not ready for multithreaded processing
+    """
+        Preprocessor variables and #ifdef stack.
 
+        The module level context is where global variables from config are collected. Files are processed
+        each in its own context created by new_file_context - it gets an immutable view of global variables
+        merged once, so processing of different files never shares any mutable state and can run concurrently.
+    """
 
-    def __init__(self):
+
+    def __init__(self, global_context = None):
         self.reset()
+        if global_context != None:
+            self.global_context = global_context
 
 
     def reset(self):
         self.global_context = {}
         self.local_context = {}
         self.currently_processed_filename = ""
+        self.currently_processed_path = ""
         self.ifdef_stack = []
+        # headers included by the processed file, path -> content hash, and headers being included now
+        self.included = {}
+        self.include_stack = []
+        # names of variables checked by directives of the processed file - its output depends only on them
+        self.consulted = set()
+        self.__frozen_global_context = None
+        self.__defined = None
+
+
+    def new_file_context(self, filename = "", file_path = ""):
+        """
+            Create independent context for processing a single file.
+            Global variables are frozen and merged once and then shared (read only) by all file contexts.
+            :param filename: name of the file for log messages
+            :param file_path: path of the file, #include paths are relative to its directory
+        """
+        if self.__frozen_global_context == None:
+            global_defined = frozenset(name for name, value in self.global_context.items() if value)
+            self.__frozen_global_context = (MappingProxyType(dict(self.global_context)), global_defined)
+        global_context, global_defined = self.__frozen_global_context
+        file_context = Context(global_context)
+        file_context.__defined = global_defined
+        file_context.on_file_start(filename)
+        file_context.currently_processed_path = file_path
+        return file_context
 
 
-    # todo on_file_start and on_file_end are not actually used - use them to verify if context is proper at the end of each file
     def on_file_start(self, filename):
-        log.info(f"Starting new local context for file '{filename}'")
+        log.info("Starting new local context for file '%s'", filename)
         self.currently_processed_filename = filename
-        self.local_context = {}
+        self.ifdef_stack = []
+        self.included = {}
+        self.include_stack = []
+        self.consulted = set()
+        self.__reset_local_context()
 
 
     def on_file_end(self):
         # todo should check that local context is empty and handle error appropriately
+        if self.ifdef_stack:
+            log.error(f"Missing #endif for '{self.ifdef_stack[-1][0]}' at the end of file '{self.currently_processed_filename}'")
 
-        log.info(f"Closing local context for file '{self.currently_processed_filename}'")
+        log.info("Closing local context for file '%s'", self.currently_processed_filename)
         self.currently_processed_filename = ""
+        self.ifdef_stack = []
+        self.__reset_local_context()
+
+
+    def __reset_local_context(self):
+        # merged variables stay valid if there was nothing local to forget
+        if self.local_context:
+            self.__defined = None
         self.local_context = {}
 
 
     def set_global_variable(self, var_name, value = True):
-        log.info(f"Global variable '{var_name}' set to '{value}'")
+        log.info("Global variable '%s' set to '%s'", var_name, value)
         self.global_context[var_name] = value
+        self.__frozen_global_context = None
+        self.__defined = None
 
 
     def set_local_variable(self, var_name, value = True):
-        log.info(f"Local variable '{var_name}' set to '{value}'")
+        log.info("Local variable '%s' set to '%s'", var_name, value)
         self.local_context[var_name] = value
+        self.__defined = None
 
 
     def is_variable_set(self, var_name):
-        if var_name in self.global_context and self.global_context[var_name]:
-            return True
-        return var_name in self.local_context and self.local_context[var_name]
+        self.consulted.add(var_name)
+        defined = self.__defined
+        if defined == None:
+            defined = self.__merge_defined()
+        return var_name in defined
+
+
+    def __global_defined(self):
+        return frozenset(name for name, value in self.global_context.items() if value)
+
+
+    def __merge_defined(self):
+        # variable is set if it is set either globally or locally
+        self.__defined = self.__global_defined() | frozenset(name for name, value in self.local_context.items() if value)
+        return self.__defined
 
 
     def ifdefed(self):
@@ -78,7 +141,8 @@ class Context:
     def push_stack(self, var_name: str, ifdefed: bool):
         ifdefed = ifdefed or self.ifdefed()
         self.ifdef_stack.append((var_name, ifdefed))
-        log.info(f" + Stack push '{var_name}, curr size = {len(self.ifdef_stack)}', ifdefed = {self.ifdefed()}")
+        if log.isEnabledFor(INFO):
+            log.info(" + Stack push '%s, curr size = %d', ifdefed = %s", var_name, len(self.ifdef_stack), self.ifdefed())
 
 
     def pop_stack(self) -> str:
@@ -86,7 +150,8 @@ class Context:
             log.error("Trying to pop from ifdef_stack, but stack already empty")
             return ""
         to_ret = self.ifdef_stack.pop()
-        log.info(f" - Stack pop '{to_ret[0]}, curr size = {len(self.ifdef_stack)}', ifdefed = {self.ifdefed()}")
+        if log.isEnabledFor(INFO):
+            log.info(" - Stack pop '%s, curr size = %d', ifdefed = %s", to_ret[0], len(self.ifdef_stack), self.ifdefed())
         return to_ret[0]
 
 
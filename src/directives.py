@@ -22,8 +22,10 @@
 
 
 from .log import log
-from .util import get_first_non_whitespace_substring, get_string_after_tag_safe, remove_after
+from .util import get_first_non_whitespace_substring, remove_after
 from .context import context
+import os
+import re
 
 
 def parse_directive(src_line_after_directive):
@@ -34,32 +36,67 @@ def parse_directive(src_line_after_directive):
     return get_first_non_whitespace_substring(tmp)
 
 
-def ifdef_handler(src_line_after_directive):
+def get_variable_name(src_line_after_directive):
+    """
+        Same as parse_directive, but without reporting errors - for inspecting directives without running them.
+    """
+    if '#' not in src_line_after_directive:
+        return ""
+    return get_first_non_whitespace_substring(remove_after(src_line_after_directive, "#"))
+
+
+# each handler gets the context of currently processed file, module level context is used if none is given
+def ifdef_handler(src_line_after_directive, file_context = context):
     variable_name = parse_directive(src_line_after_directive)
     if variable_name == "":
         log.error(f"'#ifdef{src_line_after_directive}' - missing variable name")
         return False
-    context.push_stack(variable_name, not context.is_variable_set(variable_name))
+    file_context.push_stack(variable_name, not file_context.is_variable_set(variable_name))
     return True
 
 
-def ifndef_handler(src_line_after_directive):
+def ifndef_handler(src_line_after_directive, file_context = context):
     variable_name = parse_directive(src_line_after_directive)
     if variable_name == "":
         log.error(f"'#ifndef{src_line_after_directive}' - missing variable name")
         return False
-    context.push_stack(variable_name, context.is_variable_set(variable_name))
+    file_context.push_stack(variable_name, file_context.is_variable_set(variable_name))
     return True
 
 
-def endif_handler(src_line_after_directive):
+def endif_handler(src_line_after_directive, file_context = context):
     parse_directive(src_line_after_directive)
-    context.pop_stack()
+    file_context.pop_stack()
     return True
 
-#todo add else directive
+def define_handler(src_line_after_directive, file_context = context):
+    variable_name = parse_directive(src_line_after_directive)
+    if variable_name == "":
+        log.error(f"'#define{src_line_after_directive}' - missing variable name")
+        return False
+    # define inside a removed block has no effect
+    if not file_context.ifdefed():
+        # values are not used by any directive yet, #define X=10# defines X
+        variable_name, _, value = variable_name.partition("=")
+        file_context.set_local_variable(variable_name, value or True)
+    return True
 
-#todo add define directive
+
+def include_handler(src_line_after_directive, file_context = context):
+    # imported here - includes module depends on processor, which depends on this module
+    from .includes import include_file
+    if '#' not in src_line_after_directive:
+        log.error(f"Directive not enclosed with #, unsupported yet -> '{src_line_after_directive}'")
+        return False
+    include_path = remove_after(src_line_after_directive, "#").strip()
+    if include_path == "":
+        log.error(f"'#include{src_line_after_directive}' - missing file path")
+        return False
+    if file_context.ifdefed():
+        return True
+    return include_file(include_path, file_context)
+
+#todo add else directive
 
 # todo - make a possibility to overwrite directives in config file
 # for example: if someone wants to have %ifdef% instead of #ifdef for some reason
@@ -67,30 +104,78 @@ def endif_handler(src_line_after_directive):
 handlers = {
     "#ifdef": ifdef_handler,
     "#ifndef": ifndef_handler,
-    "#endif": endif_handler
+    "#endif": endif_handler,
+    "#define": define_handler,
+    "#include": include_handler
 }
 
 
+def compile_directive_pattern(directives):
+    """
+        Build a single regex matching any of the given directives.
+        Common prefix (usually '#') is factored out, so lines without that prefix are rejected by a plain character scan.
+        Longer directives go first, so a directive that is a prefix of another one never shadows it.
+
+        :param directives: list of directive strings, like "#ifdef"
+        :return: compiled regex, match.group() is the found directive
+    """
+    prefix = os.path.commonprefix(directives)
+    suffixes = sorted((directive[len(prefix):] for directive in directives), key=len, reverse=True)
+    return re.compile(re.escape(prefix) + "(?:" + "|".join(re.escape(suffix) for suffix in suffixes) + ")")
+
+
 all_directives = list(handlers.keys())
+directive_pattern = compile_directive_pattern(all_directives)
+# the same pattern for content processed as bytes
+directive_pattern_bytes = re.compile(directive_pattern.pattern.encode('utf-8'))
+
+
+def scan_line(src_line):
+    """
+        Find directive in a line in one pass of the compiled directive pattern.
+
+        :param src_line: single line of source file
+        :return: tuple (directive, position, string after directive) or None if there is no (valid) directive in the line
+    """
+    match = directive_pattern.search(src_line)
+    if match == None:
+        return None
+    call_directive = match.group()
+    for other in directive_pattern.finditer(src_line, match.end()):
+        if other.group() != call_directive:
+            # todo - file should be first checked for errors and then processed separately in second pass to prevent errors in output
+            log.error(f"Multiple directives in one line '{src_line}'")
+            return None
+    return call_directive, match.start(), src_line[match.end():]
+
+
+def decode_line(src_line):
+    """
+        Content is processed as bytes, only lines with a directive are decoded to run it.
+        Directives are ASCII, anything else in the line (like a path in #include) is kept as surrogate escapes
+        whatever the encoding of the file is.
+    """
+    if isinstance(src_line, str):
+        return src_line
+    return src_line.decode('utf-8', 'surrogateescape')
 
 
 def get_directive(src_line):
-    # todo - for performance reasons file should be processed letter by letter and trie should be built
-    call_directive = None
-    for directive in all_directives:
-        if directive in src_line:
-            if call_directive != None:
-                # todo - file should be first checked for errors and then processed separately in second pass to prevent errors in output
-                log.error("Multiple directives in one line '{src_line}'")
-                return None
-            call_directive = directive
-    return call_directive
-
-
-def handle_line(src_line):
+    scanned = scan_line(src_line)
+    if scanned == None:
+        return None
+    return scanned[0]
+
+
+def handle_line(src_line, file_context = context):
     # log.info(f"Handle line -> '{src_line}'")
-    call_directive = get_directive(src_line)
-    if call_directive == None:
+    scanned = scan_line(src_line)
+    if scanned == None:
         return False
-    log.info(f" ### {call_directive} handler called for line '{src_line}'")
-    return handlers[call_directive](get_string_after_tag_safe(src_line, call_directive))
+    call_directive, _, src_line_after_directive = scanned
+    return call_handler(call_directive, src_line, src_line_after_directive, file_context)
+
+
+def call_handler(call_directive, src_line, src_line_after_directive, file_context = context):
+    log.info(" ### %s handler called for line '%s'", call_directive, src_line)
+    return handlers[call_directive](src_line_after_directive, file_context)
@@ -22,7 +22,13 @@
 
 import os
 from .log import log
+import errno
+import mmap
 import shutil
+import stat
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 def create_file_with_content(file_path, content):
     """
@@ -32,27 +38,91 @@ def create_file_with_content(file_path, content):
         :param content: The content of the file to create.
         :return: True if no errors.
     """
+    return create_file_with_spans(file_path, content, [(0, len(content))])
+
+
+def create_file_with_spans(file_path, content, spans):
+    """
+        Create a file and all necessary directories in its path.
+        Content of the file are slices of a bigger buffer, slices are written one by one
+        so the full output is never assembled in memory.
+
+        :param file_path: The full path to the file, including the filename.
+        :param content: The buffer that slices are taken from, str or bytes-like (written without encoding).
+        :param spans: List of (start, end) offsets into content, file content is concatenation of those slices.
+        :return: True if no errors.
+    """
     file_path = os.path.normpath(file_path)
     dir_path = os.path.dirname(file_path)
     os.makedirs(dir_path, exist_ok=True)
     
-    file_exists = os.path.exists(file_path)
-
     try:
-        with open(file_path, 'w') as f:
+        file_exists = break_hardlink(file_path)
+        with open(file_path, 'w' if isinstance(content, str) else 'wb') as f:
             if file_exists:
-                log.info(f"Overwriting existing file: '{file_path}'")
+                log.info("Overwriting existing file: '%s'", file_path)
             else:
-                log.info(f"New file created: '{file_path}'")
+                log.info("New file created: '%s'", file_path)
 
-            f.write(content)
-            f.close()
+            if isinstance(content, str):
+                for start, end in spans:
+                    f.write(content[start:end])
+            else:
+                # slices of a memoryview are not copies, a mapped file goes from the mapping straight to the output
+                with memoryview(content) as view:
+                    for start, end in spans:
+                        f.write(view[start:end])
             return True
     except IOError as e:
-        log.error("Creating file '{file_path}': {e}")
+        log.error(f"Creating file '{file_path}': {e}")
     return False
 
 
+def break_hardlink(file_path):
+    """
+        Remove the file if it is hardlinked (see emit_unchanged_file) - writing into it would change the source file too.
+        :return: True if the file exists (and was not removed)
+    """
+    try:
+        stat_result = os.lstat(file_path)
+    except OSError:
+        return False
+    if stat.S_ISREG(stat_result.st_mode) and stat_result.st_nlink > 1:
+        os.remove(file_path)
+        return False
+    return True
+
+
+COMPARE_CHUNK_BYTES = 1024 * 1024
+
+
+def file_has_spans(file_path, content, spans):
+    """
+        Check whether the file already contains exactly the given slices of content.
+        The file is compared slice by slice and reading stops at the first difference.
+
+        :return: False if the file differs, does not exist or cannot be read
+    """
+    try:
+        if isinstance(content, str):
+            # newline='' - compare line endings as they are, the same way they are written
+            with open(file_path, 'r', newline='') as f:
+                for start, end in spans:
+                    if f.read(end - start) != content[start:end]:
+                        return False
+                return f.read(1) == ""
+        # bytes-like content is compared through a memoryview in chunks, neither side is copied as a whole
+        with open(file_path, 'rb') as f, memoryview(content) as view:
+            for start, end in spans:
+                for chunk_start in range(start, end, COMPARE_CHUNK_BYTES):
+                    chunk_end = min(chunk_start + COMPARE_CHUNK_BYTES, end)
+                    if f.read(chunk_end - chunk_start) != view[chunk_start:chunk_end]:
+                        return False
+            return f.read(1) == b""
+    except (OSError, ValueError):
+        return False
+
+
 
 def for_each_file_recursive(root_folder, callback):
     """
@@ -67,28 +137,343 @@ def for_each_file_recursive(root_folder, callback):
         :param root_folder: The path to the root folder to start processing from.
         :param callback: A function that takes two parameters - file content and relative path to that file counting from root as input, and return preprocessed file content as output
     """
-    for dirpath, _, filenames in os.walk(root_folder):
-        for filename in filenames:
-            file_path = os.path.join(dirpath, filename)
+    for file_path, relative_path in list_files_recursive(root_folder):
+        call_with_file_content(file_path, relative_path, callback)
+
+
+def list_files_recursive(root_folder, path_filter = None, threads = 8):
+    """
+        Recursively list all files in the root_folder and its subfolders.
+        Directories are listed concurrently in a pool of threads (on network file systems each listing is a round trip),
+        files are yielded as soon as their directory is listed. Order is always the same - files of a directory
+        sorted by name, followed by its subdirectories in order of their names.
+
+        :param root_folder: The path to the root folder.
+        :param path_filter: optional PathFilter - excluded directories are not descended into at all
+        :param threads: number of threads listing directories
+        :return: Generator of (file path, relative path counting from root) pairs.
+    """
+    executor = ThreadPoolExecutor(max_workers=threads)
+    try:
+        # directories are listed ahead, and consumed depth first - the stack holds listings in reverse order
+        pending = [executor.submit(scan_directory, root_folder, "", path_filter)]
+        while pending:
+            try:
+                file_paths, subdirectories = pending.pop().result()
+            except OSError as e:
+                # same as os.walk, unreadable directory is skipped
+                log.info("Cannot list directory: %s", e)
+                continue
+            for file_path in file_paths:
+                yield file_path, file_path[len(root_folder):]
+            for dir_path, relative_dir in reversed(subdirectories):
+                pending.append(executor.submit(scan_directory, dir_path, relative_dir, path_filter))
+    finally:
+        # consumer may stop early, listings not started yet are not needed
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def scan_directory(dir_path, relative_dir, path_filter = None):
+    """
+        List a single directory. Types are taken from directory entries, no file is stat-ed
+        except for symlinks and file systems that do not report types.
+
+        :param relative_dir: path of the directory relative to root, "/" separated, with "/" at the end unless it is the root itself
+        :return: tuple (sorted list of file paths, sorted list of (directory path, relative directory))
+                 OSError is raised if the directory cannot be listed,
+                 symlinks to directories are neither listed nor descended into, same as os.walk
+    """
+    file_paths = []
+    subdirectories = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                if is_dir and entry.is_symlink():
+                    continue
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if path_filter == None or not path_filter.is_excluded(relative_dir + entry.name, True):
+                    subdirectories.append((entry.path, relative_dir + entry.name + "/"))
+            elif path_filter == None or path_filter.accepts_file(relative_dir + entry.name):
+                file_paths.append(entry.path)
+    file_paths.sort()
+    subdirectories.sort()
+    return file_paths, subdirectories
+
+
+def call_with_file_content(file_path, relative_path, callback, read = None):
+    """
+        Read a single file and call the callback with its content - see for_each_file_recursive.
+        Errors are reported, not raised, so one broken file does not stop processing of others.
+
+        :param read: function(file path) -> content, read_text_file if not given
+    """
+    try:
+        callback((read or read_text_file)(file_path), relative_path)
+    except Exception as e:
+        log.error(f"Crawler exception when processing {file_path}: {str(e)}")
+
+
+# files with these extensions are copied as they are, without looking at their content
+BINARY_EXTENSIONS = frozenset([
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".ico", ".bmp", ".tif", ".tiff", ".psd",
+    ".woff", ".woff2", ".ttf", ".otf", ".eot",
+    ".wasm", ".so", ".dll", ".dylib", ".exe", ".o", ".a", ".class", ".jar", ".pyc",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".tar",
+    ".pdf", ".mp3", ".mp4", ".m4a", ".ogg", ".wav", ".webm", ".mov", ".avi", ".flac",
+])
+# files with these extensions are always processed, other files are sniffed
+TEXT_EXTENSIONS = frozenset([
+    ".txt", ".md", ".js", ".mjs", ".cjs", ".ts", ".tsx", ".jsx", ".json", ".html", ".htm", ".css", ".scss", ".less",
+    ".xml", ".svg", ".yml", ".yaml", ".toml", ".ini", ".py", ".c", ".h", ".cpp", ".hpp", ".cs", ".java", ".kt",
+    ".go", ".rs", ".rb", ".php", ".sh", ".sql", ".lua", ".swift", ".vue",
+])
+SNIFF_BYTES = 8192
+
+
+def is_binary_file(file_path):
+    """
+        Cheap check whether the file is copied as it is instead of being processed as text.
+        Known extensions decide alone, other files are sniffed - a NUL byte in the first bytes means binary.
+        Text is processed as bytes in any encoding (see read_source_file), so invalid UTF-8 does not make a file binary.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in BINARY_EXTENSIONS:
+        return True
+    if extension in TEXT_EXTENSIONS:
+        return False
+    try:
+        with open(file_path, 'rb') as file:
+            head = file.read(SNIFF_BYTES)
+    except OSError:
+        # processing will report it
+        return False
+    return b"\0" in head
+
+
+def copy_file(src_path, target_path):
+    """
+        Copy a file without reading it into Python - in kernel with copy_file_range (which may even share
+        the blocks on file systems supporting it), or with shutil.copyfile where copy_file_range is not supported
+        (it uses sendfile or fcopyfile where the platform has them).
+        Creates all necessary directories in target path.
+
+        :return: True if no errors.
+    """
+    try:
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        break_hardlink(target_path)
+        if not copy_file_range(src_path, target_path):
+            shutil.copyfile(src_path, target_path)
+        log.info("Copied '%s' to '%s'", src_path, target_path)
+        return True
+    except OSError as e:
+        log.error(f"Copying file '{src_path}' to '{target_path}': {e}")
+    return False
+
+
+def copy_file_range(src_path, target_path):
+    """
+        :return: False if copy_file_range is not available for these files, target is then left for another way of copying
+    """
+    copy_range = getattr(os, "copy_file_range", None)
+    if copy_range == None:
+        return False
+    with open(src_path, 'rb') as src, open(target_path, 'wb') as target:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        while copied < size:
             try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                relative_path = file_path[len(root_folder):]
-                callback(content, relative_path)
-            except Exception as e:
-                log.error(f"Crawler exception when processing {file_path}: {str(e)}")
+                sent = copy_range(src.fileno(), target.fileno(), size - copied)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                return False
+            if sent == 0:
+                if copied == 0:
+                    # some kernels and file systems copy nothing without an error
+                    return False
+                # file got shorter while copying
+                break
+            copied += sent
+    return True
+
+
+# ioctl cloning the whole file - shares data blocks of the source on btrfs, XFS and other copy on write file systems
+FICLONE = 0x40049409
+
+
+def clone_file(src_path, target_path):
+    """
+        Make target a reflink of source - a copy sharing the same data blocks until one of them is changed.
+        :return: False if the file system does not support it
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        break_hardlink(target_path)
+        with open(src_path, 'rb') as src, open(target_path, 'wb') as target:
+            fcntl.ioctl(target.fileno(), FICLONE, src.fileno())
+        log.info("Cloned '%s' to '%s'", src_path, target_path)
+        return True
+    except OSError as e:
+        log.info("Cannot clone '%s': %s", src_path, e)
+        return False
+
+
+def link_file(src_path, target_path):
+    """
+        Make target a hardlink of source.
+        :return: False if it is not possible, for example source and target are on different file systems
+    """
+    try:
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        try:
+            os.remove(target_path)
+        except FileNotFoundError:
+            pass
+        os.link(src_path, target_path)
+        log.info("Linked '%s' to '%s'", src_path, target_path)
+        return True
+    except OSError as e:
+        log.info("Cannot link '%s': %s", src_path, e)
+        return False
+
+
+def emit_unchanged_file(src_path, target_path, mode):
+    """
+        Create output that is identical to its source file.
+        :param mode: "reflink" or "hardlink" - falls back to copy if not possible, "copy" - kernel copy (see copy_file)
+        :return: True if no errors.
+    """
+    if mode == "reflink" and clone_file(src_path, target_path):
+        return True
+    if mode == "hardlink" and link_file(src_path, target_path):
+        return True
+    return copy_file(src_path, target_path)
+
+
+# smaller files are read, mapping costs more than reading them
+MMAP_MIN_BYTES = 1024 * 1024
+
+
+def read_source_file(file_path, mapped = False):
+    """
+        Read a file for processing as bytes, without decoding it (see processor.CompiledFile).
+
+        :param mapped: memory map big files - directives are found by a regex search over the mapping
+                       and kept parts are written out from it, so the content is never copied as a whole.
+                       Only safe if nothing rewrites sources during processing: a mapped file truncated in place
+                       (open with 'w', which many editors and bundlers do) kills the whole process with SIGBUS.
+        :return: bytes, or read only mmap for big files if mapped
+    """
+    with open(file_path, 'rb') as file:
+        if not mapped or os.fstat(file.fileno()).st_size < MMAP_MIN_BYTES:
+            return file.read()
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_text_file(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+
+def remove_path(path):
+    """
+        Remove a file or a directory with all its content, if it exists.
+    """
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        log.info("Removed '%s'", path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        log.error(f"Removing '{path}': {e}")
+
+
+
+def remove_orphans(directory, kept_files):
+    """
+        Remove files that are not in kept_files, and directories left without any file.
+        :param directory: root directory, it is never removed itself
+        :param kept_files: set of normalized paths of files to keep
+        :return: number of removed files
+    """
+    removed = 0
+    for root, _, filenames in os.walk(directory, topdown=False):
+        for filename in filenames:
+            file_path = os.path.normpath(os.path.join(root, filename))
+            if file_path not in kept_files:
+                remove_path(file_path)
+                removed += 1
+        if os.path.normpath(root) != os.path.normpath(directory) and not os.listdir(root):
+            os.rmdir(root)
+            log.info("Removed empty directory '%s'", root)
+    return removed
+
+
+
+# trash directories are siblings of the wiped out directory: .<directory name>.praprocessor-trash-<random>
+TRASH_MARKER = ".praprocessor-trash-"
+
 
+def remove_trash(trash_dirs):
+    # runs in background, logging here would interleave with log of processed files
+    for trash_dir in trash_dirs:
+        shutil.rmtree(trash_dir, ignore_errors=True)
 
 
 def wipeout(directory):
     """
         Remove all content of directory but keep the directory itself.
+        Content is renamed into a sibling trash directory, which is instant on the same file system,
+        and the trash is deleted in a background thread. Trash left by an interrupted run is deleted with it.
+        Items that cannot be moved aside are removed in place.
+
         :param directory root directory to be wiped out
+        :return: thread deleting the trash, None if there is no trash
     """
     log.info(f"Wipeout of directory '{directory}'")
-    for item in os.listdir(directory):
+    directory = os.path.normpath(os.path.abspath(directory))
+    parent_dir = os.path.dirname(directory)
+    trash_prefix = "." + os.path.basename(directory) + TRASH_MARKER
+
+    items = os.listdir(directory)
+    trash_dir = None
+    if items:
+        try:
+            trash_dir = tempfile.mkdtemp(prefix=trash_prefix, dir=parent_dir)
+        except OSError as e:
+            log.info("Cannot create trash directory next to '%s': %s", directory, e)
+    for item in items:
         item_path = os.path.join(directory, item)
-        if os.path.isfile(item_path):
-            os.remove(item_path)  # Remove files
-        elif os.path.isdir(item_path):
+        if trash_dir != None:
+            try:
+                os.rename(item_path, os.path.join(trash_dir, item))
+                continue
+            except OSError as e:
+                log.info("Cannot move '%s' to trash: %s", item_path, e)
+        if os.path.isdir(item_path) and not os.path.islink(item_path):
             shutil.rmtree(item_path)  # Remove directories and their contents
+        else:
+            os.remove(item_path)  # Remove files
+
+    try:
+        trash_dirs = [os.path.join(parent_dir, name) for name in os.listdir(parent_dir) if name.startswith(trash_prefix)]
+    except OSError:
+        trash_dirs = [trash_dir] if trash_dir != None else []
+    if not trash_dirs:
+        return None
+    # not a daemon - the trash is deleted before the process exits, unless it is killed
+    thread = threading.Thread(target=remove_trash, args=(trash_dirs,), name="wipeout")
+    thread.start()
+    return thread
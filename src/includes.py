@@ -0,0 +1,204 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from .manifest import content_hash
+from .processor import compile_file
+from .directives import call_handler
+from .stats import stats
+from .log import log
+from collections import OrderedDict
+import os
+import threading
+
+
+def normalize_path(path):
+    return os.path.normpath(os.path.abspath(path))
+
+
+class HeaderCache:
+    """
+        LRU cache of compiled included files, keyed by path and content hash.
+
+        A header is read again only if its size or mtime changed, and parsed again only if its content changed,
+        so a header included by many files is read and scanned once per run.
+    """
+
+    def __init__(self, max_entries = 256):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # path -> (size, mtime_ns, content hash) of the last read
+        self.files = {}
+        # (path, content hash) -> CompiledFile, least recently used first
+        self.compiled = OrderedDict()
+
+
+    def get(self, path):
+        """
+            :param path: normalized path of the header
+            :return: tuple (content hash, CompiledFile)
+            :raises OSError: if the header cannot be read
+        """
+        stat_result = os.stat(path)
+        with self.lock:
+            known = self.files.get(path)
+            if known != None and known[0] == stat_result.st_size and known[1] == stat_result.st_mtime_ns:
+                compiled = self.compiled.get((path, known[2]))
+                if compiled != None:
+                    self.compiled.move_to_end((path, known[2]))
+                    stats.count("includes_cached")
+                    return known[2], compiled
+
+        # headers are small, read as bytes like sources (see read_source_file) but never mapped, they stay in the cache
+        with open(path, 'rb') as file:
+            content = file.read()
+        header_hash = content_hash(content)
+        with self.lock:
+            self.files[path] = (stat_result.st_size, stat_result.st_mtime_ns, header_hash)
+            compiled = self.compiled.get((path, header_hash))
+            if compiled != None:
+                # touched, but not changed
+                self.compiled.move_to_end((path, header_hash))
+                stats.count("includes_cached")
+                return header_hash, compiled
+            compiled = compile_file(content)
+            self.compiled[(path, header_hash)] = compiled
+            while len(self.compiled) > self.max_entries:
+                (evicted_path, evicted_hash), _ = self.compiled.popitem(last=False)
+                if self.files.get(evicted_path, (None, None, None))[2] == evicted_hash:
+                    del self.files[evicted_path]
+        stats.count("includes_parsed")
+        return header_hash, compiled
+
+
+    def hash_of(self, path):
+        """
+            :return: current content hash of the header, None if it cannot be read
+        """
+        try:
+            return self.get(normalize_path(path))[0]
+        except OSError:
+            return None
+
+
+    def clear(self):
+        with self.lock:
+            self.files = {}
+            self.compiled = OrderedDict()
+
+
+class IncludeGraph:
+    """
+        Which source files include which headers (directly or through other headers),
+        so that a changed header can be followed by processing exactly the files that include it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # source file path -> (relative path, set of header paths)
+        self.includes = {}
+        # header path -> set of source file paths
+        self.dependents = {}
+
+
+    def record(self, file_path, relative_path, header_paths):
+        """
+            Replace headers recorded for a source file.
+            :param header_paths: iterable of header paths the file included, empty if it includes nothing
+        """
+        header_paths = {normalize_path(header_path) for header_path in header_paths}
+        with self.lock:
+            self.__forget(file_path)
+            if header_paths:
+                self.includes[file_path] = (relative_path, header_paths)
+                for header_path in header_paths:
+                    self.dependents.setdefault(header_path, set()).add(file_path)
+
+
+    def forget(self, file_path):
+        with self.lock:
+            self.__forget(file_path)
+
+
+    def __forget(self, file_path):
+        _, header_paths = self.includes.pop(file_path, (None, ()))
+        for header_path in header_paths:
+            dependents = self.dependents[header_path]
+            dependents.discard(file_path)
+            if not dependents:
+                del self.dependents[header_path]
+
+
+    def files_including(self, header_path):
+        """
+            :return: list of (file path, relative path) of source files that include the header, sorted by path
+        """
+        with self.lock:
+            return sorted((file_path, self.includes[file_path][0])
+                          for file_path in self.dependents.get(normalize_path(header_path), ()))
+
+
+    def clear(self):
+        with self.lock:
+            self.includes = {}
+            self.dependents = {}
+
+
+header_cache = HeaderCache()
+include_graph = IncludeGraph()
+
+
+def include_file(include_path, file_context):
+    """
+        Run directives of an included file in context of the including file - its #define directives
+        set local variables of the including file. Text of the included file is not inserted into output.
+
+        :param include_path: path as written in #include, relative to the directory of the including file
+        :param file_context: context of the processed file
+        :return: False if the file cannot be included
+    """
+    including_path = file_context.include_stack[-1] if file_context.include_stack else file_context.currently_processed_path
+    header_path = normalize_path(os.path.join(os.path.dirname(including_path), include_path))
+    if header_path in file_context.include_stack:
+        log.error(f"Circular #include of '{header_path}' in file '{file_context.currently_processed_filename}'")
+        return False
+    try:
+        header_hash, compiled = header_cache.get(header_path)
+    except OSError as e:
+        log.error(f"Cannot #include '{include_path}' in file '{file_context.currently_processed_filename}': {e}")
+        return False
+    file_context.included[header_path] = header_hash
+
+    # included file has its own #ifdef stack, it must be balanced
+    including_stack = file_context.ifdef_stack
+    file_context.ifdef_stack = []
+    file_context.include_stack.append(header_path)
+    try:
+        for line_start, line_end, call_directive, src_line_after_directive, _ in compiled.instructions:
+            if call_directive != None:
+                call_handler(call_directive, compiled.line(line_start, line_end), src_line_after_directive, file_context)
+        if file_context.ifdef_stack:
+            log.error(f"Missing #endif for '{file_context.ifdef_stack[-1][0]}' at the end of included file '{header_path}'")
+    finally:
+        file_context.include_stack.pop()
+        file_context.ifdef_stack = including_stack
+    return True
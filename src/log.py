@@ -20,12 +20,39 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import atexit
+import sys
+import threading
+
+
+INFO = 10
+SUMMARY = 20
+ERROR = 30
+
+
 class Log:
+    """
+        Leveled log with deferred formatting and buffered output.
+
+        Message can be a plain string, a %-style format string with args, or a callable returning the message.
+        Formatting happens only if the level is enabled, so disabled info messages cost a single check.
+        Messages are collected in a buffer and written to stdout in big chunks - the buffer is flushed
+        when it grows big, before errors and at exit.
+
+        A thread can capture its own messages (startCapture / stopCapture) instead of logging them,
+        so that messages of work done in several threads can be printed later in a deterministic order.
+    """
+
+    BUFFER_LIMIT = 64 * 1024
 
     def __init__(self):
         # todo - add verbose and silent mode to config
         self.__verbose = False
         self.__silent = False
+        self.__buffer = []
+        self.__buffered_size = 0
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
 
     def setVerbose(self, new_value):
         if self.__silent:
@@ -39,16 +66,77 @@ class Log:
             return
         self.__silent = new_value
 
-    def info(self, message):
+    def isEnabledFor(self, level):
+        if level <= INFO:
+            return self.__verbose
+        return not self.__silent
+
+    def info(self, message, *args):
         if self.__verbose:
-            print(f"INFO: {message}")
+            self.__write("INFO: ", message, args)
 
-    def error(self, message):
+    def error(self, message, *args):
         if not self.__silent:
-            print(f"ERROR: {message}")
+            self.__write("ERROR: ", message, args)
+            self.flush()
 
-    def fatal(self, message):
-        print(f"\n!!! FATAL ERROR !!!\nmessage: {message}\n")
+    def summary(self, message, *args):
+        if not self.__silent:
+            self.__write("SUMMARY: ", message, args)
+            self.flush()
+
+    def forward(self, text):
+        """
+            Pass through output that was already formatted by another log, for example in a worker process.
+        """
+        if text:
+            capture = getattr(self.__local, "capture", None)
+            if capture != None:
+                capture.append(text)
+                return
+            with self.__lock:
+                self.__buffer.append(text)
+                self.__buffered_size += len(text)
+                full = self.__buffered_size >= Log.BUFFER_LIMIT
+            if full:
+                self.flush()
+
+    def startCapture(self):
+        self.__local.capture = []
+
+    def stopCapture(self):
+        """
+            :return: text of all messages logged by current thread since startCapture
+        """
+        capture = getattr(self.__local, "capture", None)
+        self.__local.capture = None
+        return "".join(capture or [])
+
+    def fatal(self, message, *args):
+        self.forward(self.stopCapture())
+        self.flush()
+        print(f"\n!!! FATAL ERROR !!!\nmessage: {self.__format(message, args)}\n")
         exit(1)
 
+    def flush(self):
+        with self.__lock:
+            if not self.__buffer:
+                return
+            # written under the lock, so chunks flushed from different threads never swap order
+            sys.stdout.write("".join(self.__buffer))
+            sys.stdout.flush()
+            self.__buffer = []
+            self.__buffered_size = 0
+
+    def __format(self, message, args):
+        if callable(message):
+            return message()
+        if args:
+            return message % args
+        return message
+
+    def __write(self, prefix, message, args):
+        self.forward(prefix + self.__format(message, args) + "\n")
+
 log = Log()
+atexit.register(log.flush)
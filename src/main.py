@@ -21,21 +21,611 @@
 # SOFTWARE.
 
 
-from .file_system import for_each_file_recursive, create_file_with_content, wipeout
-from .processor import process_single_file
-from .config import Config
+import contextlib
+import filecmp
+import hashlib
+import io
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .file_system import (list_files_recursive, call_with_file_content, read_source_file, create_file_with_spans, file_has_spans,
+                          is_binary_file, emit_unchanged_file, remove_path, remove_orphans, wipeout)
+from .watch import create_watcher, WatchOverflow, CHANGED
+from .manifest import Manifest, content_hash, defines_fingerprint
+from .includes import header_cache, include_graph
+from .output_cache import OutputCache, cache_key, variables_key
+from .pipeline import run_pipeline
+from .scheduler import ChangeScheduler
+from .processor import compile_file, has_directives, process_lines
+from .config import Config, Variant
+from .context import Context
+from .stats import stats
+from .log import log, INFO, ERROR
 
 
 def handle_single_file_callback(file_content, relative_path):
-    new_content = process_single_file(file_content)
-    target_file = Config.target_dir + relative_path
-    create_file_with_content(target_file, new_content)
+    """
+        Preprocess a single source file and write it to target directory of each variant.
+        :return: file record for the build manifest, see file_record
+    """
+    outputs, includes, variables = build_outputs(file_content, relative_path)
+    write_outputs(file_content, outputs, Config.src_dir + relative_path)
+    return file_record(file_content, outputs, includes, variables)
+
+
+def file_record(file_content, outputs, includes, variables):
+    """
+        :param includes: dictionary header path -> content hash of headers included by the file
+        :param variables: names of variables checked by the file
+        :return: (content hash, list of output files, includes, sorted variables) for the build manifest and include graph,
+                 None if build is not incremental and the file includes nothing
+    """
+    if not Config.incremental:
+        # everything but includes is needed only by the manifest
+        return (None, [], includes, []) if includes else None
+    return content_hash(file_content), [target_file for target_file, _ in outputs], includes, sorted(variables)
+
+
+def build_outputs(file_content, relative_path):
+    """
+        Preprocess a single source file for each variant, without writing anything.
+        Directives are scanned once and evaluated once per variant.
+
+        :return: tuple (list of (target file path, spans of file_content),
+                        dictionary header path -> content hash of headers included in any variant,
+                        set of names of variables checked in any variant)
+    """
+    stats.count("files")
+    if Config.cache_dir != None and has_directives(file_content):
+        return build_outputs_cached(file_content, relative_path)
+
+    outputs = []
+    includes = {}
+    variables = set()
+    compiled = compile_file(file_content)
+    if not compiled.instructions:
+        stats.count("files_fast_path")
+    for variant in Config.variants:
+        file_context = variant.context.new_file_context(relative_path, Config.src_dir + relative_path)
+        spans = compiled.evaluate(file_context)
+        includes.update(file_context.included)
+        variables |= file_context.consulted
+        file_context.on_file_end()
+        outputs.append((variant.target_dir + relative_path, spans))
+    return outputs, includes, variables
+
+
+def build_outputs_cached(file_content, relative_path):
+    """
+        Same as build_outputs, but spans of each variant are taken from the output cache if possible.
+        Cache key contains values of only those variables the file checks, so toggling a variable
+        the file does not mention keeps using cached result. Cached result is used only if headers it included did not change.
+    """
+    cache = OutputCache(Config.cache_dir, Config.cache_max_bytes)
+    source_hash = content_hash(file_content)
+    # variables checked by this content in any variant seen so far, None if the content was never processed
+    variables_entry = cache.get(variables_key(source_hash))
+    known_variables = set(variables_entry['variables']) if variables_entry != None else None
+    compiled = None
+    outputs = []
+    includes = {}
+    variables = set()
+    for variant in Config.variants:
+        global_context = variant.context.global_context
+        entry = None
+        if known_variables != None:
+            entry = cache.get(cache_key(source_hash, known_variables, global_context))
+        if entry != None and all(header_cache.hash_of(header_path) == header_hash
+                                 for header_path, header_hash in entry['includes'].items()):
+            stats.count("cache_hits")
+            spans = [tuple(span) for span in entry['spans']]
+            includes.update(entry['includes'])
+            variables.update(entry['variables'])
+        else:
+            stats.count("cache_misses")
+            if compiled == None:
+                compiled = compile_file(file_content)
+            file_context = variant.context.new_file_context(relative_path, Config.src_dir + relative_path)
+            spans = compiled.evaluate(file_context)
+            includes.update(file_context.included)
+            variables |= file_context.consulted
+            file_context.on_file_end()
+            # variables checked now (through a different header for example) extend the known ones,
+            # key must contain all of them
+            if known_variables == None or not file_context.consulted <= known_variables:
+                known_variables = (known_variables or set()) | file_context.consulted
+                cache.put(variables_key(source_hash), {'variables': sorted(known_variables)})
+            cache.put(cache_key(source_hash, known_variables, global_context),
+                      {'spans': spans, 'includes': file_context.included, 'variables': sorted(file_context.consulted)})
+        outputs.append((variant.target_dir + relative_path, spans))
+    return outputs, includes, variables
+
+
+def write_outputs(file_content, outputs, src_path = None):
+    """
+        :param src_path: source file, outputs identical to it are emitted by unchanged_output mode (copy, hardlink, reflink)
+    """
+    for target_file, spans in outputs:
+        # in sync mode identical outputs are not touched, their mtime stays for downstream tools
+        if Config.sync and file_has_spans(target_file, file_content, spans):
+            stats.count("outputs_unchanged")
+            continue
+        if Config.unchanged_output != "write" and src_path != None and spans == [(0, len(file_content))]:
+            stats.count("outputs_linked")
+            emit_unchanged_file(src_path, target_file, Config.unchanged_output)
+            continue
+        create_file_with_spans(target_file, file_content, spans)
 
 
 def run_full():
-    wipeout(Config.target_dir)
-    for_each_file_recursive(Config.src_dir, handle_single_file_callback)
+    """
+        Process all files from source directory.
+        Incremental build processes only files changed since the previous build (see Manifest),
+        otherwise target directories are wiped out first.
+    """
+    stats.reset()
+    manifest = None
+    if Config.incremental:
+        manifest = Manifest(Config.manifest_path)
+        manifest.load()
+
+    # without a manifest of the previous build, target directories are wiped out, or synced after processing
+    full_build = manifest == None or not manifest.loaded
+    for variant in Config.variants:
+        os.makedirs(variant.target_dir, exist_ok=True)
+        if full_build and not Config.sync:
+            wipeout(variant.target_dir)
+
+    # without manifest and sync files stream from the crawler straight into processing
+    files = list_files_recursive(Config.src_dir, Config.path_filter, Config.crawl_threads)
+    if manifest != None or Config.sync:
+        files = list(files)
+    all_files = files
+    if manifest != None:
+        files, stat_results = select_changed_files(files, manifest)
+
+    include_graph.clear()
+    records = process_files(files, Config.mmap)
+
+    if full_build and Config.sync:
+        for variant in Config.variants:
+            kept_files = {os.path.normpath(variant.target_dir + relative_path) for _, relative_path in all_files}
+            removed = remove_orphans(variant.target_dir, kept_files)
+            if removed:
+                stats.count("orphans_removed", removed)
+
+    if manifest != None:
+        for relative_path, (source_hash, outputs, includes, variables) in records.items():
+            if relative_path in stat_results:
+                manifest.record(relative_path, stat_results[relative_path], defines_fingerprint(Config.variants, variables),
+                                source_hash, outputs, includes, variables)
+        manifest.save()
+        # files that were not processed include the same headers as in the previous build
+        for relative_path, entry in manifest.files.items():
+            if relative_path not in records:
+                include_graph.record(Config.src_dir + relative_path, relative_path, entry.get('includes', {}))
+    if Config.cache_dir != None:
+        evicted = OutputCache(Config.cache_dir, Config.cache_max_bytes).evict()
+        if evicted:
+            stats.count("cache_evicted", evicted)
+    log.summary(stats.summary())
+
+
+def select_changed_files(files, manifest):
+    """
+        Filter out files that are up to date according to the manifest, forget files that no longer exist.
+        Defines are compared only for variables each file checks.
+
+        :param files: list of (file path, relative path)
+        :return: tuple (list of files to process, dictionary relative path -> stat result of files to process)
+    """
+    changed_files = []
+    stat_results = {}
+    # most files check the same few variables (or none), fingerprint is computed once per set of variables
+    fingerprints = {}
+    for file_path, relative_path in files:
+        try:
+            stat_result = os.stat(file_path)
+            variables = manifest.variables(relative_path)
+            fingerprint_key = tuple(variables) if variables != None else None
+            if fingerprint_key not in fingerprints:
+                fingerprints[fingerprint_key] = defines_fingerprint(Config.variants, variables)
+            fingerprint = fingerprints[fingerprint_key]
+            if (manifest.is_up_to_date(relative_path, stat_result, fingerprint, lambda: read_source_file(file_path))
+                    and manifest.includes_up_to_date(relative_path, header_cache.hash_of)):
+                stats.count("files_up_to_date")
+                continue
+            stat_results[relative_path] = stat_result
+        except Exception as e:
+            # processing will report it properly
+            log.info("Cannot check '%s' against manifest: %s", file_path, e)
+        changed_files.append((file_path, relative_path))
+
+    removed = manifest.forget_missing({relative_path for _, relative_path in files})
+    if removed:
+        stats.count("files_removed", removed)
+    return changed_files, stat_results
+
+
+def process_files(files, mapped = False, is_stale = None):
+    """
+        Process and write given files, in worker processes or in single process pipeline.
+
+        :param files: iterable of (file path, relative path), consumed while files are processed
+        :param mapped: memory map big files, see read_source_file
+        :param is_stale: optional function(file path) -> True if the file should be skipped,
+                         checked just before the file is read
+        :return: dictionary relative path -> file record of successfully processed files (see file_record)
+        Headers included by the processed files are recorded in the include graph.
+    """
+    records = {}
+    processed_files = []
+    binary_files = []
+    large_files = []
+
+    def text_files():
+        # files may come straight from the crawler, binary and large files are set aside while text files stream into processing
+        for file_path, relative_path in files:
+            if is_stale != None and is_stale(file_path):
+                continue
+            processed_files.append((file_path, relative_path))
+            if is_binary_file(file_path):
+                binary_files.append((file_path, relative_path))
+            elif is_large_file(file_path):
+                large_files.append((file_path, relative_path))
+            else:
+                yield file_path, relative_path
+
+    if Config.jobs > 1:
+        # worker processes are not worth starting for a single file
+        text_file_iterator = text_files()
+        first_files = list(itertools.islice(text_file_iterator, 2))
+        if len(first_files) > 1:
+            records.update(run_parallel(itertools.chain(first_files, text_file_iterator), Config.jobs, mapped))
+        else:
+            records.update(run_in_pipeline(first_files, mapped))
+    else:
+        records.update(run_in_pipeline(text_files(), mapped))
+
+    for file_path, relative_path in large_files:
+        record = stream_file(file_path, relative_path)
+        if record != None:
+            records[relative_path] = record
+    for file_path, relative_path in binary_files:
+        records[relative_path] = pass_through(file_path, relative_path)
+
+    for file_path, relative_path in processed_files:
+        record = records.get(relative_path)
+        include_graph.record(file_path, relative_path, record[2] if record != None else ())
+    return records
+
+
+def pass_through(file_path, relative_path):
+    """
+        Copy a binary file to target directory of each variant without processing it.
+        :return: file record for the build manifest, see file_record
+    """
+    stats.count("files_passed_through")
+    target_files = []
+    for variant in Config.variants:
+        target_file = variant.target_dir + relative_path
+        target_files.append(target_file)
+        if Config.sync and os.path.exists(target_file) and filecmp.cmp(file_path, target_file, shallow=False):
+            stats.count("outputs_unchanged")
+            continue
+        emit_unchanged_file(file_path, target_file, Config.unchanged_output)
+    if not Config.incremental:
+        return None
+    # content hash is for text content only, such entry is checked by size and mtime
+    return None, target_files, {}, []
+
+
+def is_large_file(file_path):
+    try:
+        return os.path.getsize(file_path) > Config.stream_threshold
+    except OSError:
+        # reading will report it
+        return False
+
+
+def stream_file(file_path, relative_path):
+    """
+        Preprocess a file bigger than stream_threshold without reading it into memory - it is read, processed
+        and written line by line for all variants at once (see process_lines), memory use is bounded by the longest line.
+        Outputs are written to temporary files next to targets and moved in place when complete.
+
+        :return: file record for the build manifest (see file_record), None on error or if there is nothing to record
+    """
+    stats.count("files")
+    stats.count("files_streamed")
+    file_contexts = [variant.context.new_file_context(relative_path, file_path) for variant in Config.variants]
+    temp_files = []
+    hasher = hashlib.sha256() if Config.incremental else None
+
+    def read_lines(src_file):
+        for line in src_file:
+            if hasher != None:
+                hasher.update(line)
+            yield line
+
+    try:
+        for variant in Config.variants:
+            target_file = os.path.normpath(variant.target_dir + relative_path)
+            os.makedirs(os.path.dirname(target_file), exist_ok=True)
+            temp_path = f"{target_file}.{os.getpid()}.tmp"
+            temp_files.append((target_file, temp_path, open(temp_path, 'wb')))
+        with open(file_path, 'rb') as src_file:
+            all_kept = process_lines(read_lines(src_file), [temp_file.write for _, _, temp_file in temp_files], file_contexts)
+        for _, _, temp_file in temp_files:
+            temp_file.close()
+
+        for target_file, temp_path, _ in temp_files:
+            if Config.sync and os.path.exists(target_file) and filecmp.cmp(temp_path, target_file, shallow=False):
+                stats.count("outputs_unchanged")
+                os.remove(temp_path)
+            elif Config.unchanged_output != "write" and all_kept:
+                stats.count("outputs_linked")
+                os.remove(temp_path)
+                emit_unchanged_file(file_path, target_file, Config.unchanged_output)
+            else:
+                # replace also breaks a hardlink to the source, see emit_unchanged_file
+                os.replace(temp_path, target_file)
+                log.info("Streamed file written: '%s'", target_file)
+    except Exception as e:
+        log.error(f"Crawler exception when processing {file_path}: {str(e)}")
+        return None
+    finally:
+        for _, temp_path, temp_file in temp_files:
+            temp_file.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    includes = {}
+    variables = set()
+    for file_context in file_contexts:
+        includes.update(file_context.included)
+        variables |= file_context.consulted
+        file_context.on_file_end()
+    if not Config.incremental:
+        return (None, [], includes, []) if includes else None
+    return hasher.hexdigest(), [target_file for target_file, _, _ in temp_files], includes, sorted(variables)
+
+
+def run_in_pipeline(files, mapped = False):
+    records = {}
+
+    def build_and_record(file_content, relative_path):
+        outputs, includes, variables = build_outputs(file_content, relative_path)
+        records[relative_path] = file_record(file_content, outputs, includes, variables)
+        return relative_path, outputs
+
+    def write(file_content, result):
+        relative_path, outputs = result
+        write_outputs(file_content, outputs, Config.src_dir + relative_path)
+
+    run_pipeline(files, build_and_record, write,
+                 Config.read_threads, Config.write_threads, Config.max_in_flight_bytes,
+                 lambda file_path: read_source_file(file_path, mapped))
+    return records
+
+
+# files are sent to worker processes in batches, to not pay process communication for each small file
+BATCH_MAX_FILES = 64
+BATCH_MAX_BYTES = 1024 * 1024
+# files are scheduled biggest first within a window of this many files in crawl order
+PARALLEL_WINDOW_FILES = 256
+
+
+def make_batches(files):
+    """
+        Split files into batches for worker processes, biggest files first,
+        so one huge file is never left for the end of the run.
+
+        :param files: list of (index, file path, relative path, size)
+        :return: list of batches, each batch is a list of (index, file path, relative path)
+    """
+    batches = []
+    batch = []
+    batch_size = 0
+    for index, file_path, relative_path, size in sorted(files, key=lambda file: file[3], reverse=True):
+        if batch and (len(batch) >= BATCH_MAX_FILES or batch_size + size > BATCH_MAX_BYTES):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append((index, file_path, relative_path))
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def init_worker(src_dir, variants, incremental, sync, unchanged_output, cache_dir, cache_max_bytes, verbose, silent):
+    """
+        Runs once in each worker process - config is sent to the worker once, not with each task.
+        :param variants: list of (name, target dir, global variables)
+    """
+    Config.src_dir = src_dir
+    Config.incremental = incremental
+    Config.sync = sync
+    Config.unchanged_output = unchanged_output
+    Config.cache_dir = cache_dir
+    Config.cache_max_bytes = cache_max_bytes
+    Config.variants = [Variant(name, target_dir, Context(global_context)) for name, target_dir, global_context in variants]
+    # forked worker inherits log state of the parent, setters refuse to make it both verbose and silent
+    log.setVerbose(False)
+    log.setSilent(False)
+    if verbose:
+        log.setVerbose(True)
+    if silent:
+        log.setSilent(True)
+
+
+def process_batch_in_worker(batch, mapped = False):
+    """
+        Process files in worker process. Log output and stats of each file are captured and sent back,
+        parent process prints them in the same order as a single process run would.
+
+        :return: list of (index, log output, stats counters, file record or None, exit code or None)
+    """
+    results = []
+    for index, file_path, relative_path in batch:
+        output = io.StringIO()
+        exit_code = None
+        records = []
+        stats.reset()
+        with contextlib.redirect_stdout(output):
+            try:
+                call_with_file_content(file_path, relative_path,
+                                       lambda content, path: records.append(handle_single_file_callback(content, path)),
+                                       lambda file_path: read_source_file(file_path, mapped))
+            except SystemExit as e:
+                exit_code = e.code
+            log.flush()
+        record = records[0] if records else None
+        results.append((index, output.getvalue(), dict(stats.counters), record, exit_code))
+    return results
+
+
+def run_parallel(files, jobs, mapped = False):
+    """
+        Process files in a pool of worker processes.
+        Log output, stats and exit status are the same as if files were processed one by one in crawl order.
+
+        Files are taken from the iterable (straight from the crawler in a full run) in windows of PARALLEL_WINDOW_FILES,
+        each window is split into batches biggest files first. Next window is taken while workers still have work,
+        so processing overlaps with crawling.
+
+        :param files: iterable of (file path, relative path) in crawl order
+        :param jobs: number of worker processes
+        :param mapped: memory map big files, see read_source_file
+        :return: dictionary relative path -> file record of successfully processed files (see file_record)
+    """
+    variants = [(variant.name, variant.target_dir, dict(variant.context.global_context)) for variant in Config.variants]
+    initargs = (Config.src_dir, variants, Config.incremental, Config.sync, Config.unchanged_output, Config.cache_dir, Config.cache_max_bytes,
+                log.isEnabledFor(INFO), not log.isEnabledFor(ERROR))
+    # buffered messages would be inherited by forked workers and printed twice
+    log.flush()
+
+    # files are numbered in crawl order
+    numbered_files = enumerate(files)
+    relative_paths = {}
+    finished = {}
+    next_index = 0
+    exit_code = None
+    records = {}
+    futures = set()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=initargs) as executor:
+
+        def submit_window():
+            """
+                :return: False if there are no more files
+            """
+            window = []
+            for index, (file_path, relative_path) in itertools.islice(numbered_files, PARALLEL_WINDOW_FILES):
+                try:
+                    size = os.path.getsize(file_path)
+                except OSError:
+                    size = 0
+                relative_paths[index] = relative_path
+                window.append((index, file_path, relative_path, size))
+            for batch in make_batches(window):
+                futures.add(executor.submit(process_batch_in_worker, batch, mapped))
+            return len(window) == PARALLEL_WINDOW_FILES
+
+        more_files = submit_window()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                for index, output, counters, record, file_exit_code in future.result():
+                    finished[index] = (output, counters, record, file_exit_code)
+            # print results in crawl order as soon as all previous files are done
+            while next_index in finished and exit_code == None:
+                output, counters, record, exit_code = finished.pop(next_index)
+                log.forward(output)
+                for name, value in counters.items():
+                    stats.count(name, value)
+                if record != None:
+                    records[relative_paths[next_index]] = record
+                del relative_paths[next_index]
+                next_index += 1
+            if exit_code != None:
+                for not_started in futures:
+                    not_started.cancel()
+                break
+            # look ahead - workers must not run out of batches while the next window is crawled
+            if more_files and len(futures) < jobs * 2:
+                more_files = submit_window()
+
+    if exit_code != None:
+        log.flush()
+        exit(exit_code)
+    return records
+
+
+def handle_watch_events(events, is_stale = None):
+    """
+        Remove outputs of removed paths, then process changed files together (in parallel with --jobs).
+
+        :param events: list of (CHANGED or REMOVED, absolute path of file or directory in source directory)
+        :param is_stale: optional function(path) -> True if the path changed again and will come in a later batch
+    """
+    changed_files = []
+    for kind, file_path in events:
+        relative_path = file_path[len(Config.src_dir):]
+        if kind == CHANGED:
+            if Config.path_filter != None and not Config.path_filter.accepts_path(relative_path.replace(os.sep, "/")):
+                continue
+            changed_files.append((file_path, relative_path))
+        else:
+            # files changed earlier in a directory removed later in the batch are gone
+            changed_files = [(changed_path, changed_relative_path) for changed_path, changed_relative_path in changed_files
+                             if not changed_path.startswith(file_path + os.sep)]
+            for variant in Config.variants:
+                remove_path(variant.target_dir + relative_path)
+            include_graph.forget(file_path)
+
+    # files including a changed or removed header are processed again
+    queued = {changed_path for changed_path, _ in changed_files}
+    for _, file_path in events:
+        for dependent in include_graph.files_including(file_path):
+            if dependent[0] not in queued and os.path.exists(dependent[0]):
+                queued.add(dependent[0])
+                changed_files.append(dependent)
+    if changed_files:
+        stats.reset()
+        # files are never mapped in watch mode, they are processed right when tools are rewriting them
+        process_files(changed_files, False, is_stale)
+        log.info("Processed %d changed files: %s", len(changed_files), stats.summary())
+    log.flush()
+
 
-def run_watch():
-    # todo not yet implemented
-    pass
+def run_watch(stop_event = None):
+    """
+        Watch source directory and process changed files until interrupted with ctrl+c.
+        :param stop_event: optional threading.Event to stop watching, checked between events
+    """
+    try:
+        watcher = create_watcher(Config.src_dir, [variant.target_dir for variant in Config.variants],
+                                 Config.watch_backend, Config.poll_interval, Config.path_filter)
+    except OSError as e:
+        log.fatal(f"Cannot start watch mode: {e}")
+    log.info("Watching '%s' for changes", Config.src_dir)
+    log.flush()
+    scheduler = ChangeScheduler(handle_watch_events, Config.watch_debounce, Config.watch_max_delay)
+    try:
+        while stop_event == None or not stop_event.is_set():
+            try:
+                events = watcher.read_events(timeout = 0.5)
+            except WatchOverflow:
+                log.error("Too many changes at once, processing all files again")
+                scheduler.wait_idle()
+                run_full()
+                log.flush()
+                continue
+            scheduler.add(events)
+    except KeyboardInterrupt:
+        log.info("Watch mode stopped")
+    finally:
+        watcher.close()
+        scheduler.stop()
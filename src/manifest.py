@@ -0,0 +1,178 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+from .log import log
+import hashlib
+import json
+import os
+
+
+def content_hash(content):
+    """
+        :param content: content of a source file as read by the crawler, str or bytes-like
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+def defines_fingerprint(variants, variables = None):
+    """
+        Fingerprint of everything that changes output of a file apart from its content - variants and their global variables.
+        :param variables: names of variables the file checks, only those are part of the fingerprint; all if None
+    """
+    description = [
+        [variant.name, variant.target_dir, sorted(name for name, value in variant.context.global_context.items()
+                                                  if value and (variables == None or name in variables))]
+        for variant in variants
+    ]
+    return hashlib.sha256(json.dumps(description).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+        Persistent record of the previous build, used by incremental builds.
+
+        For each source file (by relative path) there is an entry:
+            size, mtime_ns - stat of the source file when it was processed
+            hash - content_hash of the source file
+            fingerprint - defines fingerprint the file was processed with
+            outputs - list of output files it produced
+            includes - path -> content hash of headers it included
+            variables - names of variables its directives checked, fingerprint covers only those
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.loaded = False
+
+
+    def load(self):
+        """
+            :return: True if manifest of a previous build was loaded, False if there is none (or it is unusable)
+        """
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            if data.get('version') != Manifest.VERSION:
+                log.info("Manifest '%s' has unsupported version, doing full build", self.path)
+                return False
+            self.files = data['files']
+            self.loaded = True
+        except FileNotFoundError:
+            log.info("Manifest '%s' not found, doing full build", self.path)
+        except (ValueError, KeyError, AttributeError) as e:
+            log.error(f"Manifest '{self.path}' is broken, doing full build: {e}")
+        return self.loaded
+
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'version': Manifest.VERSION, 'files': self.files}, file)
+        # replace is atomic - a build interrupted while saving never leaves half written manifest
+        os.replace(temp_path, self.path)
+
+
+    def is_up_to_date(self, relative_path, stat_result, fingerprint, read_content):
+        """
+            Check whether outputs of the file from the previous build are still valid.
+            Cheap check of size and mtime comes first, content is hashed only if mtime changed but size did not.
+
+            :param read_content: function returning current content of the file, called only if needed
+        """
+        entry = self.files.get(relative_path)
+        if entry == None or entry['fingerprint'] != fingerprint:
+            return False
+        if not all(os.path.exists(output) for output in entry['outputs']):
+            return False
+        if entry['size'] == stat_result.st_size and entry['mtime_ns'] == stat_result.st_mtime_ns:
+            return True
+        if entry['size'] != stat_result.st_size:
+            return False
+        if content_hash(read_content()) != entry['hash']:
+            return False
+        # touched, but not changed
+        entry['mtime_ns'] = stat_result.st_mtime_ns
+        return True
+
+
+    def variables(self, relative_path):
+        """
+            :return: sorted names of variables the file checked in the previous build, None if unknown
+        """
+        return self.files.get(relative_path, {}).get('variables')
+
+
+    def includes_up_to_date(self, relative_path, current_hash):
+        """
+            :param current_hash: function(header path) -> current content hash of the header or None
+            :return: False if any header included by the file in the previous build changed
+        """
+        includes = self.files.get(relative_path, {}).get('includes', {})
+        return all(current_hash(header_path) == header_hash for header_path, header_hash in includes.items())
+
+
+    def record(self, relative_path, stat_result, fingerprint, source_hash, outputs, includes = None, variables = None):
+        """
+            Record a processed file. Outputs of the previous build of this file that were not produced again are deleted.
+        """
+        old_entry = self.files.get(relative_path)
+        if old_entry != None:
+            remove_outputs(set(old_entry['outputs']) - set(outputs))
+        self.files[relative_path] = {
+            'size': stat_result.st_size,
+            'mtime_ns': stat_result.st_mtime_ns,
+            'hash': source_hash,
+            'fingerprint': fingerprint,
+            'outputs': outputs,
+            'includes': includes or {},
+            'variables': variables,
+        }
+
+
+    def forget_missing(self, existing_relative_paths):
+        """
+            Remove entries of source files that no longer exist, together with their outputs.
+            :return: number of removed entries
+        """
+        missing = [relative_path for relative_path in self.files if relative_path not in existing_relative_paths]
+        for relative_path in missing:
+            log.info("Source '%s' was removed, removing its outputs", relative_path)
+            remove_outputs(self.files.pop(relative_path)['outputs'])
+        return len(missing)
+
+
+def remove_outputs(outputs):
+    for output in outputs:
+        try:
+            os.remove(output)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.error(f"Cannot remove output '{output}': {e}")
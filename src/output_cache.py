@@ -0,0 +1,137 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from . import __version__
+from .log import log
+import hashlib
+import json
+import os
+import threading
+
+
+def variables_key(source_hash):
+    """
+        Key of the entry listing variables checked by a file with the given content (in any variant seen so far).
+        :param source_hash: content_hash of the source file
+    """
+    return hashlib.sha256(json.dumps([__version__, source_hash]).encode('utf-8')).hexdigest()
+
+
+def cache_key(source_hash, variables, global_context):
+    """
+        Output of a file is fully determined by its content, version of the tool and values of variables
+        its directives check - other global variables do not change it.
+        :param source_hash: content_hash of the source file
+        :param variables: names of variables checked by the file
+        :param global_context: global variables of the variant
+    """
+    description = [__version__, source_hash, [[name, bool(global_context.get(name))] for name in sorted(variables)]]
+    return hashlib.sha256(json.dumps(description).encode('utf-8')).hexdigest()
+
+
+class OutputCache:
+    """
+        Content addressed cache of processing results, shared by all runs (and checkouts) using the same directory.
+
+        Each entry is a small JSON file cache_dir/<first 2 characters of key>/<key>.json. For each file content
+        there is an entry with variables checked by the file (variables_key), and an entry per values of those
+        variables (cache_key) with spans of the output (see CompiledFile.evaluate), headers included and
+        variables checked while processing. Entries are written to a temporary
+        file and renamed, so processes sharing the cache never see half written entries.
+        A hit updates mtime of the entry, evict removes least recently used entries above the size limit.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+
+    def get(self, key):
+        """
+            :return: dictionary stored by put, None if there is no entry
+        """
+        path = self.entry_path(key)
+        try:
+            with open(path, 'r') as file:
+                entry = json.load(file)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.info("Cannot read cache entry '%s': %s", path, e)
+            return None
+        return entry
+
+
+    def put(self, key, entry):
+        path = self.entry_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'w') as file:
+                json.dump(entry, file)
+            os.replace(temp_path, path)
+        except OSError as e:
+            # cache is only an optimization, the output was already computed
+            log.info("Cannot write cache entry '%s': %s", path, e)
+
+
+    def evict(self):
+        """
+            Remove least recently used entries until the cache is below 90% of its size limit.
+            :return: number of removed entries
+        """
+        entries = []
+        total_size = 0
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat_result.st_mtime_ns, stat_result.st_size, path))
+                total_size += stat_result.st_size
+        if total_size <= self.max_bytes:
+            return 0
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another process
+                pass
+            except OSError as e:
+                log.info("Cannot remove cache entry '%s': %s", path, e)
+                continue
+            total_size -= size
+            removed += 1
+        return removed
@@ -0,0 +1,175 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import re
+
+
+def translate_pattern(pattern):
+    """
+        Translate a gitignore style glob to a regex matching relative paths with "/" separators.
+        '*' and '?' do not match "/", '**' matches any number of directories. A pattern with "/"
+        at the start or in the middle is relative to the root, otherwise it matches at any depth.
+    """
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.strip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            content = pattern[i + 1:end]
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            parts.append("[" + content.replace("\\", "\\\\") + "]")
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(parts)
+
+
+def parse_gitignore(content):
+    """
+        :return: list of patterns from content of a .gitignore file, comments and empty lines skipped
+    """
+    patterns = []
+    for line in content.splitlines():
+        if line.startswith("#"):
+            continue
+        # trailing spaces are ignored unless escaped
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped = stripped[:-1] + " "
+        if stripped == "":
+            continue
+        if stripped.startswith("\\#") or stripped.startswith("\\!"):
+            stripped = stripped[1:]
+        patterns.append(stripped)
+    return patterns
+
+
+class PathFilter:
+    """
+        Decides which files of source directory are processed, by include and exclude glob patterns
+        with .gitignore syntax (including "!" negation and trailing "/" for directories only).
+
+        Exclude patterns are evaluated like in .gitignore - the last matching pattern wins. Consecutive patterns
+        of the same kind are compiled into a single regex, so usually a path is checked by one regex match.
+        If there are include patterns, a file has to match at least one of them.
+        An excluded directory is excluded with everything inside it, so crawlers can skip it without listing it.
+    """
+
+    def __init__(self, include = None, exclude = None):
+        """
+            :param include: list of patterns, None or empty to include all files
+            :param exclude: list of patterns, in order of precedence (later wins)
+        """
+        self.include = None
+        if include:
+            self.include = re.compile("|".join(f"(?:{translate_pattern(pattern)})" for pattern in include) + r"\Z")
+
+        # segments of consecutive rules of the same kind: (negated, directories only, compiled regex)
+        self.segments = []
+        current_kind = None
+        current_patterns = []
+        for pattern in exclude or []:
+            negated = pattern.startswith("!")
+            if negated:
+                pattern = pattern[1:]
+            kind = (negated, pattern.endswith("/"))
+            if kind != current_kind and current_patterns:
+                self.__add_segment(current_kind, current_patterns)
+                current_patterns = []
+            current_kind = kind
+            current_patterns.append(translate_pattern(pattern))
+        if current_patterns:
+            self.__add_segment(current_kind, current_patterns)
+
+
+    def __add_segment(self, kind, regexes):
+        negated, directories_only = kind
+        self.segments.append((negated, directories_only, re.compile("|".join(f"(?:{regex})" for regex in regexes) + r"\Z")))
+
+
+    def is_excluded(self, relative_path, is_dir = False):
+        """
+            Check the path itself, not its parent directories (see is_path_excluded).
+            :param relative_path: path relative to source directory, "/" separated, without leading "/"
+        """
+        for negated, directories_only, regex in reversed(self.segments):
+            if directories_only and not is_dir:
+                continue
+            if regex.match(relative_path):
+                return not negated
+        return False
+
+
+    def accepts_file(self, relative_path):
+        """
+            Check a file whose parent directories are known not to be excluded.
+        """
+        if self.is_excluded(relative_path):
+            return False
+        return self.include == None or self.include.match(relative_path) != None
+
+
+    def accepts_path(self, relative_path):
+        """
+            Check a file with all its parent directories - for single paths, like watch events.
+        """
+        parts = relative_path.strip("/").split("/")
+        for depth in range(1, len(parts)):
+            if self.is_excluded("/".join(parts[:depth]), True):
+                return False
+        return self.accepts_file("/".join(parts))
+
+
+def load_path_filter(src_dir, include, exclude, use_gitignore):
+    """
+        :param use_gitignore: add patterns from .gitignore in src_dir before exclude patterns
+        :return: PathFilter, None if there are no patterns at all
+    """
+    patterns = []
+    if use_gitignore:
+        try:
+            with open(os.path.join(src_dir, ".gitignore"), 'r', encoding='utf-8') as file:
+                patterns.extend(parse_gitignore(file.read()))
+        except FileNotFoundError:
+            pass
+    patterns.extend(exclude or [])
+    if not patterns and not include:
+        return None
+    return PathFilter(include, patterns)
@@ -0,0 +1,141 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+from .file_system import read_text_file
+from .log import log
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+
+
+class ByteBudget:
+    """
+        Semaphore counted in bytes - limits how much file content is in flight at once.
+        A single item bigger than the whole budget is still let through when nothing else is in flight.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.__condition = threading.Condition()
+
+
+    def acquire(self, amount):
+        with self.__condition:
+            while self.in_flight > 0 and self.in_flight + amount > self.limit:
+                self.__condition.wait()
+            self.in_flight += amount
+
+
+    def release(self, amount):
+        with self.__condition:
+            self.in_flight -= amount
+            self.__condition.notify_all()
+
+
+class OrderedOutput:
+    """
+        Log output of items finished out of order, forwarded to log in order of items.
+    """
+
+    def __init__(self):
+        self.__finished = {}
+        self.__next_index = 0
+        self.__lock = threading.Lock()
+
+
+    def finish(self, index, text):
+        with self.__lock:
+            self.__finished[index] = text
+            while self.__next_index in self.__finished:
+                log.forward(self.__finished.pop(self.__next_index))
+                self.__next_index += 1
+
+
+def run_pipeline(files, process, write, read_threads, write_threads, max_in_flight_bytes, read_file = read_text_file):
+    """
+        Read, process and write files in overlapping stages:
+        reader threads prefetch file contents, processing runs in the calling thread in crawl order,
+        writer threads write the results. Content of a file counts against max_in_flight_bytes
+        from the moment its read starts until all its outputs are written.
+        Log messages of each file are captured and printed in crawl order, as if files were processed one by one.
+
+        :param files: iterable of (file path, relative path) pairs
+        :param process: function(content, relative_path) -> result, called in crawl order in the calling thread
+        :param write: function(content, result), called in writer threads
+        :param read_threads: number of reader threads
+        :param write_threads: number of writer threads, with one writer outputs are written in crawl order
+        :param max_in_flight_bytes: limit of file content read but not yet written
+        :param read_file: function(file path) -> content, called in reader threads
+    """
+    budget = ByteBudget(max_in_flight_bytes)
+    reads = queue.Queue(maxsize=read_threads * 4)
+    output = OrderedOutput()
+
+    def write_and_release(index, processing_log, content, result, size):
+        log.startCapture()
+        try:
+            write(content, result)
+        except Exception as e:
+            log.error(f"Pipeline exception when writing: {str(e)}")
+        finally:
+            output.finish(index, processing_log + log.stopCapture())
+            budget.release(size)
+
+    with ThreadPoolExecutor(read_threads) as readers, ThreadPoolExecutor(write_threads) as writers:
+
+        def feed():
+            try:
+                for file_path, relative_path in files:
+                    try:
+                        size = os.path.getsize(file_path)
+                    except OSError:
+                        size = 0
+                    budget.acquire(size)
+                    reads.put((file_path, relative_path, size, readers.submit(read_file, file_path)))
+            finally:
+                reads.put(None)
+
+        # daemon - if processing stops with fatal error, feeder blocked on full budget must not keep the process alive
+        threading.Thread(target=feed, daemon=True).start()
+
+        index = 0
+        while True:
+            item = reads.get()
+            if item == None:
+                break
+            file_path, relative_path, size, read = item
+            log.startCapture()
+            try:
+                content = read.result()
+                result = process(content, relative_path)
+            except Exception as e:
+                log.error(f"Crawler exception when processing {file_path}: {str(e)}")
+                output.finish(index, log.stopCapture())
+                budget.release(size)
+                index += 1
+                continue
+            writers.submit(write_and_release, index, log.stopCapture(), content, result, size)
+            index += 1
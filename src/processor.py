@@ -21,13 +21,203 @@
 # SOFTWARE.
 
 
-from .directives import handle_line
+from .directives import scan_line, call_handler, get_variable_name, decode_line, directive_pattern, directive_pattern_bytes
 from .context import context
+from .stats import stats
 
-def process_single_file(content):
-    to_ret = []
-    lines = content.split("\n")
-    for src_line in lines:
-        if not handle_line(src_line) and not context.ifdefed():
-            to_ret.append(src_line)
-    return "\n".join(to_ret)
+
+def pattern_for(content):
+    """
+        :param content: str, or bytes-like (bytes, mmap) content which is processed without decoding
+        :return: directive pattern matching the type of content
+    """
+    return directive_pattern if isinstance(content, str) else directive_pattern_bytes
+
+
+def has_directives(content):
+    """
+        Prescan of the whole file content - a single pass of the compiled directive pattern, no splitting into lines.
+        :return: False if content surely contains no directive
+    """
+    return pattern_for(content).search(content) != None
+
+
+def add_span(spans, start, end):
+    if start >= end:
+        return
+    if spans and spans[-1][1] == start:
+        spans[-1] = (spans[-1][0], end)
+        return
+    spans.append((start, end))
+
+
+class CompiledFile:
+    """
+        Directives of a single file, scanned once and then evaluated any number of times.
+        Evaluation runs the directive handlers against given context and visits only directive lines,
+        so its cost depends on number of directives, not on number of lines.
+
+        instructions is a flat list of tuples (line start, line end, directive, string after directive, variable name),
+        one per line containing a directive. Directive is None for a line that cannot be handled (multiple directives).
+
+        Content can be str, or bytes (and mmap) which are never decoded - offsets are then byte offsets,
+        only directive lines are decoded (see decode_line), so any ASCII compatible encoding and "\r\n" line ends are kept as they are.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.instructions = []
+        content_length = len(content)
+        newline = "\n" if isinstance(content, str) else b"\n"
+        pattern = pattern_for(content)
+        match = pattern.search(content)
+        while match != None:
+            line_start = content.rfind(newline, 0, match.start()) + 1
+            line_end = content.find(newline, match.end())
+            if line_end == -1:
+                line_end = content_length
+            scanned = scan_line(self.line(line_start, line_end))
+            if scanned == None:
+                self.instructions.append((line_start, line_end, None, "", ""))
+            else:
+                call_directive, _, src_line_after_directive = scanned
+                variable_name = get_variable_name(src_line_after_directive)
+                self.instructions.append((line_start, line_end, call_directive, src_line_after_directive, variable_name))
+            if line_end == content_length:
+                break
+            match = pattern.search(content, line_end + 1)
+
+
+    def line(self, line_start, line_end):
+        return decode_line(self.content[line_start:line_end])
+
+
+    def variables(self):
+        return {instruction[4] for instruction in self.instructions if instruction[4] != ""}
+
+
+    def evaluate(self, file_context = context):
+        """
+            Run directives of the file and compute which parts of content are kept in the output.
+            Text between two directive lines is kept or dropped as a whole.
+            The result is equivalent to splitting content by "\\n", dropping lines and joining them back with "\\n".
+
+            :param file_context: context of the processed file, module level context if not given
+            :return: list of (start, end) offsets into content, output is concatenation of those slices
+        """
+        spans = []
+        content_length = len(self.content)
+        position = 0
+        final_line_kept = None
+        for line_start, line_end, call_directive, src_line_after_directive, _ in self.instructions:
+            if not file_context.ifdefed():
+                add_span(spans, position, line_start)
+            handled = False
+            if call_directive != None:
+                handled = call_handler(call_directive, self.line(line_start, line_end), src_line_after_directive, file_context)
+            line_kept = not handled and not file_context.ifdefed()
+            position = min(line_end + 1, content_length)
+            if line_kept:
+                add_span(spans, line_start, position)
+            if line_end == content_length:
+                final_line_kept = line_kept
+
+        if final_line_kept == None:
+            final_line_kept = not file_context.ifdefed()
+            if final_line_kept:
+                add_span(spans, position, content_length)
+
+        # the last line has no "\n" after it - if it is dropped, separator of the previous kept line goes away with it
+        if not final_line_kept and spans:
+            start, end = spans.pop()
+            add_span(spans, start, end - 1)
+        return spans
+
+
+    def render(self, file_context = context):
+        spans = self.evaluate(file_context)
+        if spans == [(0, len(self.content))]:
+            return self.content
+        return self.content[:0].join(self.content[start:end] for start, end in spans)
+
+
+def compile_file(content):
+    """
+        Scan content for directives once, result can be evaluated many times for different defines.
+        :param content: content of the file
+        :return: CompiledFile
+    """
+    return CompiledFile(content)
+
+
+def get_kept_spans(content, file_context = context):
+    return compile_file(content).evaluate(file_context)
+
+
+def process_single_file_spans(content, file_context = context):
+    """
+        :param content: content of the file
+        :param file_context: context of the processed file (see Context.new_file_context), module level context if not given
+        :return: list of (start, end) offsets into content that make up the preprocessed file
+    """
+    # fast path - if there is no directive and we are not inside unclosed #ifdef, output is exactly the input
+    if not file_context.ifdefed() and not has_directives(content):
+        stats.count("files_fast_path")
+        return [(0, len(content))]
+    return get_kept_spans(content, file_context)
+
+
+def process_single_file(content, file_context = context):
+    spans = process_single_file_spans(content, file_context)
+    if spans == [(0, len(content))]:
+        return content
+    return content[:0].join(content[start:end] for start, end in spans)
+
+
+def split_lines(lines):
+    """
+        :param lines: iterable of lines as read from a file (str or bytes), each ending with "\\n" except possibly the last one
+        :return: generator of the same strings as "".join(lines).split("\\n"), without joining anything
+    """
+    line = ""
+    terminated = True
+    for line in lines:
+        terminated = line[-1:] in ("\n", b"\n")
+        yield line[:-1] if terminated else line
+    if terminated:
+        yield line[:0]
+
+
+def process_lines(lines, writers, file_contexts):
+    """
+        Streaming counterpart of CompiledFile.evaluate for files too big to be held in memory.
+        Lines are processed one at a time for all outputs at once, only the current line is in memory.
+        Output is the same as from evaluate - kept lines joined with "\\n".
+
+        :param lines: iterable of lines as read from a file, str or bytes (only lines with a directive are decoded)
+        :param writers: one function per file context, kept text is passed to it piece by piece
+        :param file_contexts: contexts of the processed file (see Context.new_file_context), one per output
+        :return: True if every output is exactly the input
+    """
+    started = [False] * len(file_contexts)
+    all_kept = True
+    for src_line in split_lines(lines):
+        scanned = None
+        if pattern_for(src_line).search(src_line) != None:
+            decoded_line = decode_line(src_line)
+            scanned = scan_line(decoded_line)
+        for index, file_context in enumerate(file_contexts):
+            handled = False
+            if scanned != None:
+                call_directive, _, src_line_after_directive = scanned
+                handled = call_handler(call_directive, decoded_line, src_line_after_directive, file_context)
+            if handled or file_context.ifdefed():
+                all_kept = False
+                continue
+            # separator is written before the next kept line, never after the last one
+            if started[index]:
+                writers[index]("\n" if isinstance(src_line, str) else b"\n")
+            started[index] = True
+            if src_line:
+                writers[index](src_line)
+    return all_kept
@@ -0,0 +1,162 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from .log import log
+import threading
+import time
+
+
+class ChangeScheduler:
+    """
+        Collects watch events and hands them over to handler in batches, in a background thread.
+
+        An event coming when nothing happened for debounce seconds and no batch is running (a single save)
+        starts a batch right away. Otherwise events of the same path are coalesced, only the last one is kept,
+        and a batch starts when no event came for debounce seconds, or at the latest max_delay seconds after
+        the first pending event, so a long burst (git checkout, formatter run) is processed in few big batches
+        instead of file by file. Only one batch runs at a time, events coming during it are collected for the next one.
+
+        Every event of a path increases its generation. Handler gets is_stale(path) which tells
+        whether the path changed again after the batch started (or has pending events, for a path
+        not in the batch) - such file is pending again, so the handler can skip it.
+    """
+
+    def __init__(self, handler, debounce = 0.05, max_delay = 1.0):
+        """
+            :param handler: function(events, is_stale), events is list of (kind, path)
+            :param debounce: seconds without events before a batch starts
+            :param max_delay: maximum seconds from the first pending event to start of its batch
+        """
+        self.handler = handler
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.generations = {}
+        self.first_event = None
+        self.last_event = None
+        # last event of any batch, tells whether a new event starts a burst or continues one
+        self.latest_event = None
+        self.immediate = False
+        self.busy = False
+        self.stopped = False
+        self.exception = None
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+
+    def add(self, events):
+        """
+            :param events: list of (kind, path)
+        """
+        if not events:
+            return
+        with self.condition:
+            self.__raise_exception()
+            now = time.monotonic()
+            for kind, path in events:
+                # re-insert, so batch keeps order of the last events
+                self.pending.pop(path, None)
+                self.pending[path] = kind
+                self.generations[path] = self.generations.get(path, 0) + 1
+            if self.first_event == None:
+                self.first_event = now
+                self.immediate = not self.busy and (self.latest_event == None or now - self.latest_event >= self.debounce)
+            self.last_event = now
+            self.latest_event = now
+            self.condition.notify_all()
+
+
+    def wait_idle(self):
+        """
+            Wait until all pending events are processed.
+        """
+        with self.condition:
+            while (self.pending or self.busy) and self.exception == None:
+                self.condition.wait()
+            self.__raise_exception()
+
+
+    def stop(self):
+        """
+            Process pending events without waiting for debounce and stop the background thread.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.__raise_exception()
+
+
+    def __raise_exception(self):
+        if self.exception != None:
+            exception, self.exception = self.exception, None
+            raise exception
+
+
+    def __next_batch(self):
+        with self.condition:
+            while True:
+                if self.pending:
+                    now = time.monotonic()
+                    due = min(self.last_event + self.debounce, self.first_event + self.max_delay)
+                    if self.immediate or self.stopped or now >= due:
+                        break
+                    self.condition.wait(due - now)
+                elif self.stopped:
+                    return None
+                else:
+                    self.condition.wait()
+            batch = [(kind, path) for path, kind in self.pending.items()]
+            self.pending = {}
+            self.first_event = None
+            self.last_event = None
+            self.immediate = False
+            self.busy = True
+            return batch, {path: self.generations[path] for _, path in batch}
+
+
+    def __run(self):
+        while True:
+            next_batch = self.__next_batch()
+            if next_batch == None:
+                return
+            batch, generations = next_batch
+            log.info("Processing batch of %d changes", len(batch))
+            try:
+                self.handler(batch, lambda path: self.generations.get(path) != generations.get(path))
+            except Exception as e:
+                log.error(f"Watch exception when processing changes: {str(e)}")
+            except BaseException as e:
+                # fatal errors (SystemExit) are raised again in the watching thread
+                with self.condition:
+                    self.exception = e
+            finally:
+                with self.condition:
+                    for _, path in batch:
+                        if path not in self.pending:
+                            del self.generations[path]
+                    self.busy = False
+                    self.condition.notify_all()
+            if self.exception != None:
+                return
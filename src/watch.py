@@ -0,0 +1,362 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+from .log import log
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+
+CHANGED = "changed"
+REMOVED = "removed"
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class WatchOverflow(Exception):
+    """
+        Kernel dropped some events - the whole tree has to be processed again.
+    """
+
+
+def coalesce(events):
+    """
+        Keep only the last event of each path, for example file written several times is processed once.
+        :param events: list of (CHANGED or REMOVED, path)
+    """
+    last_events = {}
+    for kind, path in events:
+        last_events.pop(path, None)
+        last_events[path] = kind
+    return [(kind, path) for path, kind in last_events.items()]
+
+
+def is_excluded_dir(directory, root, excluded_dirs, path_filter = None):
+    """
+        :param directory: directory inside the watched root
+        :param excluded_dirs: set of normalized paths of directories not to watch
+        :param path_filter: optional PathFilter - directories it excludes are not watched either
+    """
+    directory = os.path.normpath(directory)
+    if directory in excluded_dirs:
+        return True
+    if path_filter == None:
+        return False
+    return path_filter.is_excluded(os.path.relpath(directory, root).replace(os.sep, "/"), True)
+
+
+def load_libc():
+    libc_name = ctypes.util.find_library("c")
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError(errno.ENOSYS, "inotify is not available")
+    return libc
+
+
+class InotifyWatcher:
+    """
+        Recursive watch of a directory tree with Linux inotify, through ctypes - no 3rd party dependency.
+        Every directory has its own watch, directories created later are watched as soon as they appear.
+
+        read_events returns list of (CHANGED or REMOVED, absolute path). CHANGED is reported when a file was
+        written and closed or moved into the tree, REMOVED for removed files and directories.
+    """
+
+    def __init__(self, root, excluded_dirs = (), path_filter = None):
+        """
+            :param root: directory to watch
+            :param excluded_dirs: directories not to watch, for example target directory inside root
+            :param path_filter: optional PathFilter - excluded directories (like node_modules) are not walked nor watched
+        """
+        self.root = root
+        self.excluded_dirs = {os.path.normpath(directory) for directory in excluded_dirs}
+        self.path_filter = path_filter
+        self.__libc = load_libc()
+        self.fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1 failed: {os.strerror(error)}")
+        self.directories = {}
+        self.add_tree(root)
+
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+    def add_directory(self, directory):
+        wd = self.__libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            log.error(f"Cannot watch directory '{directory}': {os.strerror(error)}")
+            return False
+        self.directories[wd] = directory
+        return True
+
+
+    def add_tree(self, directory):
+        """
+            Watch directory and all its subdirectories.
+            :return: list of files found in the tree - they might have been created before the watch started
+        """
+        files = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [name for name in dirnames
+                           if not is_excluded_dir(os.path.join(dirpath, name), self.root, self.excluded_dirs, self.path_filter)]
+            if self.add_directory(dirpath):
+                files.extend(os.path.join(dirpath, filename) for filename in filenames)
+        return files
+
+
+    def read_events(self, timeout = None):
+        """
+            Wait for events at most timeout seconds (forever if None).
+            :return: list of (CHANGED or REMOVED, path) - only the last event of each path, in order of those last events
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            events.extend(self.__parse(buffer))
+        return coalesce(events)
+
+
+    def __parse(self, buffer):
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                raise WatchOverflow()
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory == None or mask & IN_DELETE_SELF:
+                continue
+            path = os.path.join(directory, name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if not is_excluded_dir(path, self.root, self.excluded_dirs, self.path_filter):
+                        events.extend((CHANGED, file_path) for file_path in self.add_tree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    events.append((REMOVED, path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                events.append((CHANGED, path))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append((REMOVED, path))
+        return events
+
+
+
+class PollingWatcher:
+    """
+        Watch of a directory tree by polling, for file systems where inotify events never arrive (network or bind mounts).
+
+        Keeps a snapshot of every directory: its mtime and (inode, size, mtime, is directory) of each entry.
+        Each tick stats only directories - a directory is listed again only if its mtime changed,
+        which catches created, removed and renamed files. Files modified in place do not change mtime
+        of their directory, so every full_scan_every ticks all directories are listed again.
+
+        Has the same read_events interface as InotifyWatcher.
+    """
+
+    def __init__(self, root, excluded_dirs = (), interval = 1.0, full_scan_every = 10, path_filter = None):
+        """
+            :param root: directory to watch
+            :param excluded_dirs: directories not to watch, for example target directory inside root
+            :param interval: seconds between ticks
+            :param full_scan_every: every n-th tick lists all directories
+            :param path_filter: optional PathFilter - excluded directories (like node_modules) are not listed
+        """
+        self.root = root
+        self.excluded_dirs = {os.path.normpath(directory) for directory in excluded_dirs}
+        self.path_filter = path_filter
+        self.interval = interval
+        self.full_scan_every = full_scan_every
+        self.directories = {}
+        self.ticks = 0
+        self.add_tree(root)
+        self.__next_tick = time.monotonic() + interval
+
+
+    def close(self):
+        pass
+
+
+    def add_tree(self, directory):
+        """
+            Add directory and all its subdirectories to the snapshot.
+            :return: list of files found in the tree
+        """
+        files = []
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            entries = self.__scan(current)
+            if entries == None:
+                continue
+            for name, entry in entries.items():
+                if entry[3]:
+                    pending.append(os.path.join(current, name))
+                else:
+                    files.append(os.path.join(current, name))
+        return files
+
+
+    def read_events(self, timeout = None):
+        """
+            Wait for the next tick at most timeout seconds (until the next tick if None).
+            :return: list of (CHANGED or REMOVED, path), empty if the tick did not happen yet
+        """
+        wait = self.__next_tick - time.monotonic()
+        if timeout != None and wait > timeout:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self.__next_tick = time.monotonic() + self.interval
+        return coalesce(self.poll())
+
+
+    def poll(self):
+        """
+            Single tick - compare the snapshot with the file system and update it.
+            :return: list of (CHANGED or REMOVED, path)
+        """
+        self.ticks += 1
+        full_scan = self.ticks % self.full_scan_every == 0
+        started = time.process_time()
+        events = []
+        rescanned = 0
+        for directory in list(self.directories):
+            snapshot = self.directories.get(directory)
+            if snapshot == None:
+                # removed together with its parent during this tick
+                continue
+            old_mtime, old_entries = snapshot
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                # removal is reported when its parent is listed again
+                continue
+            if mtime == old_mtime and not full_scan:
+                continue
+            rescanned += 1
+            new_entries = self.__scan(directory)
+            if new_entries != None:
+                events.extend(self.__diff(directory, old_entries, new_entries))
+        log.info("Poll tick %d%s: %d directories, %d listed, %d events, %.2f ms CPU, interval %.2f s",
+                 self.ticks, " (full scan)" if full_scan else "", len(self.directories), rescanned, len(events),
+                 (time.process_time() - started) * 1000, self.interval)
+        return events
+
+
+    def __scan(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            entries = {}
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    is_dir = entry.is_dir(follow_symlinks = False)
+                    if is_dir and is_excluded_dir(entry.path, self.root, self.excluded_dirs, self.path_filter):
+                        continue
+                    stat_result = entry.stat(follow_symlinks = False)
+                    entries[entry.name] = (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns, is_dir)
+        except OSError:
+            self.__forget_tree(directory)
+            return None
+        self.directories[directory] = (mtime, entries)
+        return entries
+
+
+    def __diff(self, directory, old_entries, new_entries):
+        events = []
+        for name, old_entry in old_entries.items():
+            new_entry = new_entries.get(name)
+            if new_entry == None or new_entry[3] != old_entry[3]:
+                path = os.path.join(directory, name)
+                if old_entry[3]:
+                    self.__forget_tree(path)
+                events.append((REMOVED, path))
+        for name, new_entry in new_entries.items():
+            old_entry = old_entries.get(name)
+            path = os.path.join(directory, name)
+            if new_entry[3]:
+                if old_entry == None or not old_entry[3]:
+                    events.extend((CHANGED, file_path) for file_path in self.add_tree(path))
+            elif old_entry != new_entry:
+                events.append((CHANGED, path))
+        return events
+
+
+    def __forget_tree(self, directory):
+        prefix = directory + os.sep
+        for known in [known for known in self.directories if known == directory or known.startswith(prefix)]:
+            del self.directories[known]
+
+
+def create_watcher(root, excluded_dirs = (), backend = "auto", poll_interval = 1.0, path_filter = None):
+    """
+        :param backend: "inotify", "poll" or "auto" - inotify if available, polling otherwise
+        :param path_filter: optional PathFilter, directories it excludes are not watched
+    """
+    if backend != "poll":
+        try:
+            return InotifyWatcher(root, excluded_dirs, path_filter)
+        except OSError as e:
+            if backend == "inotify":
+                raise
+            log.info("inotify is not available (%s), watching by polling", e)
+    return PollingWatcher(root, excluded_dirs, poll_interval, path_filter = path_filter)
@@ -0,0 +1,101 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import asyncio
+import os
+import tempfile
+import shutil
+from src.async_api import process_file, process_tree
+from src.log import log
+
+
+
+class TestAsyncApi(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.test_dir, "in")
+        self.target_dir = os.path.join(self.test_dir, "out")
+        os.makedirs(os.path.join(self.src_dir, "sub"))
+        for i in range(5):
+            with open(os.path.join(self.src_dir, "sub", f"file{i}.js"), 'w') as f:
+                f.write(f"a{i}\n// #ifdef PROD#\nprod\n// #endif#\n")
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def read(self, path):
+        with open(path, 'r') as f:
+            return f.read()
+
+
+    async def test_process_file(self):
+        target = os.path.join(self.target_dir, "single.js")
+        result = await process_file(os.path.join(self.src_dir, "sub", "file0.js"), target, ["PROD"])
+        self.assertEqual(result.error, None)
+        self.assertEqual(self.read(target), "a0\nprod\n")
+
+
+    async def test_process_file_keeps_encoding_and_line_ends(self):
+        src = os.path.join(self.src_dir, "latin1.txt")
+        with open(src, 'wb') as f:
+            f.write("caf\u00e9\r\n// #ifdef PROD#\r\nprod\r\n// #endif#\r\n".encode("latin-1"))
+        target = os.path.join(self.target_dir, "latin1.txt")
+        result = await process_file(src, target)
+        self.assertEqual(result.error, None)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), "caf\u00e9\r\n".encode("latin-1"))
+
+
+    async def test_process_file_error(self):
+        result = await process_file(os.path.join(self.src_dir, "missing.js"), os.path.join(self.target_dir, "x.js"))
+        self.assertNotEqual(result.error, None)
+
+
+    async def test_process_tree_yields_result_per_file(self):
+        results = [result async for result in process_tree(self.src_dir, self.target_dir, {"PROD": False})]
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result.error == None for result in results))
+        self.assertEqual(self.read(os.path.join(self.target_dir, "sub", "file3.js")), "a3\n")
+
+
+    async def test_process_tree_cancellation(self):
+        processed = []
+
+        async def consume():
+            async for result in process_tree(self.src_dir, self.target_dir):
+                processed.append(result)
+                if len(processed) == 2:
+                    await asyncio.sleep(10)
+
+        task = asyncio.create_task(consume())
+        while len(processed) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(len(processed), 2)
@@ -0,0 +1,115 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import os
+import json
+import tempfile
+import shutil
+from src.config import Config
+from src.context import context
+from src.log import log
+
+
+
+class TestLoadConfig(unittest.TestCase):
+    def setUp(self):
+        # todo this is not threadsafe due to global context and config
+        context.reset()
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        context.reset()
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def load(self, config):
+        config_path = os.path.join(self.test_dir, "praprocessor.config.json")
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        Config.load_config(working_dir=self.test_dir, config_path=config_path)
+
+
+    def test_without_variants_single_default_variant(self):
+        self.load({"src_dir": "in", "target_dir": "out", "#define": ["DEBUG"]})
+        self.assertEqual(len(Config.variants), 1)
+        self.assertEqual(Config.variants[0].target_dir, os.path.join(self.test_dir, "out"))
+        self.assertEqual(Config.variants[0].context.global_context, {"DEBUG": True})
+
+
+    def test_variants_share_top_level_defines(self):
+        self.load({
+            "src_dir": "in",
+            "#define": ["COMMON"],
+            "variants": [
+                {"name": "PROD", "#define": ["PROD"], "target_dir": "out_prod"},
+                {"name": "DEV", "target_dir": "out_dev"},
+            ]
+        })
+        self.assertEqual([variant.name for variant in Config.variants], ["PROD", "DEV"])
+        self.assertEqual(Config.variants[0].target_dir, os.path.join(self.test_dir, "out_prod"))
+        self.assertEqual(Config.variants[0].context.global_context, {"COMMON": True, "PROD": True})
+        self.assertEqual(Config.variants[1].context.global_context, {"COMMON": True})
+
+
+    def test_path_filter_from_patterns_and_gitignore(self):
+        os.makedirs(os.path.join(self.test_dir, "in"))
+        with open(os.path.join(self.test_dir, "in", ".gitignore"), 'w') as f:
+            f.write("# dependencies\nnode_modules/\n*.log\n")
+        self.load({"src_dir": "in", "target_dir": "out", "exclude": ["!keep.log"], "gitignore": True})
+        self.assertFalse(Config.path_filter.accepts_path("node_modules/lib/index.js"))
+        self.assertFalse(Config.path_filter.accepts_path("debug.log"))
+        self.assertTrue(Config.path_filter.accepts_path("keep.log"))
+
+        self.load({"src_dir": "in", "target_dir": "out"})
+        self.assertEqual(Config.path_filter, None)
+
+
+    def test_variants_with_same_name_are_fatal(self):
+        with self.assertRaises(SystemExit):
+            self.load({
+                "src_dir": "in",
+                "variants": [
+                    {"name": "PROD", "target_dir": "out_1"},
+                    {"name": "PROD", "target_dir": "out_2"},
+                ]
+            })
+
+
+    def test_variants_with_same_target_dir_are_fatal(self):
+        with self.assertRaises(SystemExit):
+            self.load({
+                "src_dir": "in",
+                "variants": [
+                    {"name": "PROD", "target_dir": "out"},
+                    {"name": "DEV", "target_dir": "out/"},
+                ]
+            })
+
+
+    def test_variant_target_dir_same_as_src_dir_is_fatal(self):
+        with self.assertRaises(SystemExit):
+            self.load({"src_dir": "in", "variants": [{"name": "PROD", "target_dir": "in"}]})
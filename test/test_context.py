@@ -51,6 +51,69 @@ class TestContexBasicOperations(unittest.TestCase):
         self.assertEqual(self.context.local_context, {})
 
 
+    @patch.object(log, 'info')
+    @patch.object(log, 'error')
+    def test_on_file_end_unclosed_ifdef(self, mock_error, _):
+        self.context.on_file_start("testfile.txt")
+        self.context.push_stack("var", True)
+        self.context.on_file_end()
+        mock_error.assert_called_once()
+        self.assertEqual(self.context.ifdef_stack, [])
+        self.assertFalse(self.context.ifdefed())
+
+
+    @patch.object(log, 'info')
+    def test_new_file_context_is_independent(self, _):
+        self.context.set_global_variable("global_var", True)
+        self.context.push_stack("outer", True)
+        file_context = self.context.new_file_context("testfile.txt")
+
+        self.assertEqual(file_context.currently_processed_filename, "testfile.txt")
+        self.assertTrue(file_context.is_variable_set("global_var"))
+        self.assertFalse(file_context.ifdefed())
+
+        file_context.set_local_variable("local_var", True)
+        file_context.push_stack("inner", True)
+        self.assertTrue(file_context.is_variable_set("local_var"))
+        self.assertFalse(self.context.is_variable_set("local_var"))
+        self.assertEqual(self.context.ifdef_stack, [("outer", True)])
+
+
+    @patch.object(log, 'info')
+    def test_new_file_context_global_variables_are_read_only(self, _):
+        self.context.set_global_variable("global_var", True)
+        file_context = self.context.new_file_context()
+        with self.assertRaises(TypeError):
+            file_context.set_global_variable("other_var", True)
+
+
+    @patch.object(log, 'info')
+    def test_new_file_context_sees_global_variables_set_before_it_was_created(self, _):
+        first = self.context.new_file_context()
+        self.context.set_global_variable("global_var", True)
+        second = self.context.new_file_context()
+        self.assertFalse(first.is_variable_set("global_var"))
+        self.assertTrue(second.is_variable_set("global_var"))
+
+
+    @patch.object(log, 'info')
+    def test_checked_variables_are_recorded_per_file(self, _):
+        file_context = self.context.new_file_context()
+        file_context.is_variable_set("A")
+        file_context.is_variable_set("B")
+        file_context.set_local_variable("C", True)
+        self.assertEqual(file_context.consulted, {"A", "B"})
+        file_context.on_file_start("next.txt")
+        self.assertEqual(file_context.consulted, set())
+
+
+    @patch.object(log, 'info')
+    def test_global_variable_is_not_hidden_by_local_false(self, _):
+        self.context.set_global_variable("var", True)
+        self.context.set_local_variable("var", False)
+        self.assertTrue(self.context.is_variable_set("var"))
+
+
     @patch.object(log, 'info')
     def test_on_file_start_dirty_context(self, _):
         filename = "testfile.txt"
@@ -178,3 +178,36 @@ class TestHandlers(unittest.TestCase):
         result = get_directive(" #endif asdf #ifndef ")
         self.assertEqual(result, None)
         self.assertEqual(mock_error.call_count, 2)
+
+
+
+class TestScanLine(unittest.TestCase):
+    @patch.object(log, 'error')
+    def test_scan_line_returns_directive_position_and_rest_of_line(self, mock_error):
+        result = scan_line("  // #ifdef A# ")
+        self.assertEqual(result, ("#ifdef", 5, " A# "))
+        mock_error.assert_not_called()
+
+    @patch.object(log, 'error')
+    def test_scan_line_without_directive_returns_none(self, mock_error):
+        self.assertEqual(scan_line("const a = '#fff'; // ifdef"), None)
+        self.assertEqual(scan_line(""), None)
+        mock_error.assert_not_called()
+
+    @patch.object(log, 'error')
+    def test_scan_line_same_directive_twice_is_not_an_error(self, mock_error):
+        result = scan_line("#endif# #endif#")
+        self.assertEqual(result, ("#endif", 0, "# #endif#"))
+        mock_error.assert_not_called()
+
+    @patch.object(log, 'error')
+    def test_scan_line_different_directives_returns_none_with_error(self, mock_error):
+        self.assertEqual(scan_line("#ifndef A# x #endif#"), None)
+        mock_error.assert_called_once()
+
+    def test_compiled_pattern_prefers_longer_directive(self):
+        pattern = compile_directive_pattern(["#if", "#ifdef", "#else"])
+        self.assertEqual(pattern.search(" #ifdef A#").group(), "#ifdef")
+        self.assertEqual(pattern.search(" #if A#").group(), "#if")
+        self.assertEqual(pattern.search(" #else#").group(), "#else")
+        self.assertEqual(pattern.search(" # if"), None)
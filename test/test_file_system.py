@@ -23,9 +23,12 @@
 import unittest
 import os
 import tempfile
+import errno
+import mmap
 import shutil
-from unittest.mock import Mock
-from src.file_system import create_file_with_content, for_each_file_recursive, wipeout
+from unittest.mock import Mock, patch
+from src.file_system import (create_file_with_content, create_file_with_spans, file_has_spans, for_each_file_recursive, list_files_recursive, remove_orphans, wipeout,
+                             is_binary_file, copy_file, emit_unchanged_file, read_source_file)
 from src.log import log
 
 
@@ -76,6 +79,60 @@ class TestCreateFileWithContent(unittest.TestCase):
             self.assertEqual(f.read(), new_content)
 
 
+    def test_create_file_with_spans(self):
+        file_path = os.path.join(self.test_dir, "spans.txt")
+        content = "0123456789"
+        result = create_file_with_spans(file_path, content, [(0, 2), (5, 7), (9, 10)])
+
+        self.assertTrue(result)
+        with open(file_path, 'r') as f:
+            self.assertEqual(f.read(), "01569")
+
+
+    def test_file_has_spans(self):
+        file_path = os.path.join(self.test_dir, "spans.txt")
+        content = "01\r\n3456789"
+        create_file_with_spans(file_path, content, [(0, 4), (9, 10)])
+
+        self.assertTrue(file_has_spans(file_path, content, [(0, 4), (9, 10)]))
+        self.assertTrue(file_has_spans(file_path, content, [(0, 2), (2, 4), (9, 10)]))
+        self.assertFalse(file_has_spans(file_path, content, [(0, 4)]))
+        self.assertFalse(file_has_spans(file_path, content, [(0, 4), (9, 10), (5, 6)]))
+        self.assertFalse(file_has_spans(file_path, content, [(0, 3), (3, 4), (8, 9)]))
+        self.assertFalse(file_has_spans(os.path.join(self.test_dir, "missing.txt"), content, [(0, 4)]))
+
+
+    def test_source_files_are_mapped_only_on_request(self):
+        src_path = os.path.join(self.test_dir, "src.txt")
+        with open(src_path, 'wb') as f:
+            f.write(b"a\r\n#ifdef A#\n")
+        with patch("src.file_system.MMAP_MIN_BYTES", 1):
+            self.assertEqual(read_source_file(src_path), b"a\r\n#ifdef A#\n")
+            content = read_source_file(src_path, mapped = True)
+            self.assertIsInstance(content, mmap.mmap)
+            content.close()
+        self.assertEqual(read_source_file(src_path, mapped = True), b"a\r\n#ifdef A#\n")
+
+
+    def test_spans_of_mapped_file(self):
+        src_path = os.path.join(self.test_dir, "src.txt")
+        with open(src_path, 'wb') as f:
+            f.write(b"01\r\n3456789")
+        file_path = os.path.join(self.test_dir, "spans.txt")
+        with open(src_path, 'rb') as f:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.assertTrue(create_file_with_spans(file_path, content, [(0, 4), (9, 10)]))
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), b"01\r\n8")
+
+        with patch("src.file_system.COMPARE_CHUNK_BYTES", 3):
+            self.assertTrue(file_has_spans(file_path, content, [(0, 4), (9, 10)]))
+            self.assertFalse(file_has_spans(file_path, content, [(0, 4), (8, 10)]))
+            self.assertFalse(file_has_spans(file_path, content, [(0, 4)]))
+        # no view of the mapping is left behind
+        content.close()
+
+
     def test_error_handling(self):
         # Create a directory with the same name as the file we want to create
         file_path = os.path.join(self.test_dir, "error_case")
@@ -141,6 +198,149 @@ class TestForEachFileRecursive(unittest.TestCase):
         mock_callback.assert_any_call("Content of file 1", "/subdir_1/a/b/c/file1.txt")
         mock_callback.assert_any_call("Content of file 2", "/subdir_2/a/b/file2.txt")
 
+    def test_crawl_order_is_sorted_depth_first(self):
+        for relative_path in ['b.txt', 'a.txt', 'z/2.txt', 'z/1.txt', 'm/x/deep.txt', 'm/top.txt']:
+            os.makedirs(os.path.dirname(os.path.join(self.test_dir, relative_path)), exist_ok=True)
+            with open(os.path.join(self.test_dir, relative_path), 'w') as f:
+                f.write(relative_path)
+
+        for threads in [1, 4]:
+            relative_paths = [relative_path for _, relative_path in list_files_recursive(self.test_dir, threads=threads)]
+            self.assertEqual(relative_paths, ['/a.txt', '/b.txt', '/m/top.txt', '/m/x/deep.txt', '/z/1.txt', '/z/2.txt'])
+
+    def test_crawl_does_not_follow_directory_symlinks(self):
+        os.makedirs(os.path.join(self.test_dir, 'real'))
+        with open(os.path.join(self.test_dir, 'real', 'file.txt'), 'w') as f:
+            f.write("content")
+        os.symlink(os.path.join(self.test_dir, 'real'), os.path.join(self.test_dir, 'link'))
+
+        relative_paths = [relative_path for _, relative_path in list_files_recursive(self.test_dir)]
+        self.assertEqual(relative_paths, ['/real/file.txt'])
+
+    def test_crawl_streams_files_and_can_be_stopped(self):
+        for i in range(20):
+            os.makedirs(os.path.join(self.test_dir, f'dir_{i:02}'))
+            with open(os.path.join(self.test_dir, f'dir_{i:02}', 'file.txt'), 'w') as f:
+                f.write("content")
+
+        files = list_files_recursive(self.test_dir, threads=4)
+        self.assertEqual(next(files)[1], '/dir_00/file.txt')
+        files.close()
+
+    def test_crawl_of_missing_directory_is_empty(self):
+        self.assertEqual(list(list_files_recursive(os.path.join(self.test_dir, 'missing'))), [])
+
+
+
+class TestBinaryFiles(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, name, data):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+    def test_binary_file_detection(self):
+        self.assertTrue(is_binary_file(self.write("image.PNG", b"text content")))
+        self.assertFalse(is_binary_file(self.write("script.js", b"\0\xff")))
+        self.assertTrue(is_binary_file(self.write("data.bin", b"abc\0def")))
+        # text in other encodings is processed as bytes
+        self.assertFalse(is_binary_file(self.write("latin1", "za\u017c\u00f3\u0142\u0107".encode("latin-1", "replace") + b"\xf3 text")))
+        self.assertFalse(is_binary_file(self.write("Makefile", "za\u017c\u00f3\u0142\u0107 #ifdef A#".encode("utf-8"))))
+        # multibyte character cut at the end of sniffed bytes is fine
+        self.assertFalse(is_binary_file(self.write("cut", b"a" * 8191 + "\u017c".encode("utf-8"))))
+
+
+    def test_copy_file(self):
+        data = bytes(range(256)) * 4096
+        src_path = self.write("big.wasm", data)
+        target_path = os.path.join(self.test_dir, "out", "sub", "big.wasm")
+        self.assertTrue(copy_file(src_path, target_path))
+        with open(target_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertFalse(copy_file(os.path.join(self.test_dir, "missing"), target_path))
+
+
+    def test_copy_file_without_copy_file_range(self):
+        data = bytes(range(256)) * 4096
+        src_path = self.write("big.wasm", data)
+        for copy_range in [None, Mock(side_effect=OSError(errno.ENOSYS, "not supported")), Mock(return_value=0)]:
+            target_path = os.path.join(self.test_dir, "out", "big.wasm")
+            with patch.object(os, "copy_file_range", copy_range):
+                self.assertTrue(copy_file(src_path, target_path))
+            with open(target_path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+
+
+class TestEmitUnchangedFile(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        self.src_path = os.path.join(self.test_dir, "src.txt")
+        self.target_path = os.path.join(self.test_dir, "out", "target.txt")
+        with open(self.src_path, 'w') as f:
+            f.write("source")
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def test_hardlink_is_not_written_through(self):
+        self.assertTrue(emit_unchanged_file(self.src_path, self.target_path, "hardlink"))
+        self.assertEqual(os.stat(self.src_path).st_ino, os.stat(self.target_path).st_ino)
+
+        create_file_with_content(self.target_path, "processed")
+        with open(self.src_path) as f:
+            self.assertEqual(f.read(), "source")
+        with open(self.target_path) as f:
+            self.assertEqual(f.read(), "processed")
+
+
+    def test_reflink_and_copy_give_same_content(self):
+        for mode in ["reflink", "copy"]:
+            # reflink falls back to copy on file systems without FICLONE
+            self.assertTrue(emit_unchanged_file(self.src_path, self.target_path, mode))
+            self.assertNotEqual(os.stat(self.src_path).st_ino, os.stat(self.target_path).st_ino)
+            with open(self.target_path) as f:
+                self.assertEqual(f.read(), "source")
+
+
+
+class TestRemoveOrphans(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def test_only_orphans_are_removed(self):
+        for relative_path in ["kept.txt", "orphan.txt", os.path.join("sub", "kept.txt"), os.path.join("sub", "orphan.txt"),
+                              os.path.join("gone", "deeper", "orphan.txt")]:
+            create_file_with_content(os.path.join(self.test_dir, relative_path), "content")
+        os.makedirs(os.path.join(self.test_dir, "empty"))
+        kept_files = {os.path.join(self.test_dir, "kept.txt"), os.path.join(self.test_dir, "sub", "kept.txt")}
+
+        self.assertEqual(remove_orphans(self.test_dir, kept_files), 3)
+        self.assertEqual(sorted(os.listdir(self.test_dir)), ["kept.txt", "sub"])
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, "sub")), ["kept.txt"])
+
 
 
 class TestWipeout(unittest.TestCase):
@@ -198,3 +398,22 @@ class TestWipeout(unittest.TestCase):
         self.assertTrue(os.path.exists(self.test_dir))
         self.assertTrue(os.path.isdir(self.test_dir))
         self.assertEqual(os.listdir(self.test_dir), [])
+
+
+    def test_wipeout_moves_content_aside_and_deletes_it_with_leftover_trash(self):
+        target_dir = os.path.join(self.test_dir, "target")
+        os.makedirs(os.path.join(target_dir, "subdir"))
+        leftover = os.path.join(self.test_dir, ".target.praprocessor-trash-interrupted")
+        os.makedirs(os.path.join(leftover, "subdir"))
+        os.makedirs(os.path.join(self.test_dir, "other"))
+
+        thread = wipeout(target_dir)
+        self.assertEqual(os.listdir(target_dir), [])
+        thread.join()
+        self.assertEqual(sorted(os.listdir(self.test_dir)), ["other", "target"])
+
+
+    def test_wipeout_without_content_and_trash_starts_no_thread(self):
+        target_dir = os.path.join(self.test_dir, "target")
+        os.makedirs(target_dir)
+        self.assertEqual(wipeout(target_dir), None)
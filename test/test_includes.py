@@ -0,0 +1,159 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import unittest.mock
+import os
+import tempfile
+import shutil
+from src.includes import HeaderCache, IncludeGraph, header_cache
+from src.processor import compile_file
+from src.context import Context
+from src.stats import stats
+from src.log import log
+
+
+
+class TestHeaderCache(unittest.TestCase):
+    def setUp(self):
+        stats.reset()
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, "header.h")
+        self.write("#define A#\n")
+
+
+    def tearDown(self):
+        stats.reset()
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, content, mtime_ns = None):
+        with open(self.path, 'w') as f:
+            f.write(content)
+        if mtime_ns != None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+
+    def test_header_is_parsed_once(self):
+        cache = HeaderCache()
+        first = cache.get(self.path)
+        second = cache.get(self.path)
+        self.assertIs(first[1], second[1])
+        self.assertEqual(stats.get("includes_parsed"), 1)
+        self.assertEqual(stats.get("includes_cached"), 1)
+
+
+    def test_changed_header_is_parsed_again(self):
+        cache = HeaderCache()
+        cache.get(self.path)
+        self.write("#define B#\n#define C#\n")
+        header_hash, compiled = cache.get(self.path)
+        self.assertEqual(compiled.variables(), {"B", "C"})
+        self.assertEqual(stats.get("includes_parsed"), 2)
+
+
+    def test_touched_header_is_not_parsed_again(self):
+        cache = HeaderCache()
+        cache.get(self.path)
+        self.write("#define A#\n", mtime_ns = 10 ** 18)
+        cache.get(self.path)
+        self.assertEqual(stats.get("includes_parsed"), 1)
+
+
+    def test_least_recently_used_header_is_evicted(self):
+        cache = HeaderCache(max_entries = 1)
+        other_path = os.path.join(self.test_dir, "other.h")
+        with open(other_path, 'w') as f:
+            f.write("")
+        cache.get(self.path)
+        cache.get(other_path)
+        self.assertEqual(list(cache.compiled), [(other_path, cache.files[other_path][2])])
+        self.assertNotIn(self.path, cache.files)
+
+
+
+class TestIncludeGraph(unittest.TestCase):
+    def test_files_including_header(self):
+        graph = IncludeGraph()
+        graph.record("/src/a.txt", "/a.txt", ["/src/defines.h", "/src/other.h"])
+        graph.record("/src/b.txt", "/b.txt", ["/src/defines.h"])
+        self.assertEqual(graph.files_including("/src/defines.h"), [("/src/a.txt", "/a.txt"), ("/src/b.txt", "/b.txt")])
+
+        graph.record("/src/a.txt", "/a.txt", [])
+        self.assertEqual(graph.files_including("/src/defines.h"), [("/src/b.txt", "/b.txt")])
+        self.assertEqual(graph.files_including("/src/other.h"), [])
+
+
+
+class TestIncludeDirective(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        header_cache.clear()
+        self.test_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.test_dir, "sub"))
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, relative_path, content):
+        with open(os.path.join(self.test_dir, relative_path), 'w') as f:
+            f.write(content)
+
+
+    def process(self, content, global_context = {}):
+        file_context = Context(dict(global_context)).new_file_context("file.txt", os.path.join(self.test_dir, "file.txt"))
+        result = compile_file(content).render(file_context)
+        return result, file_context
+
+
+    def test_defines_of_included_file_are_used(self):
+        self.write(os.path.join("sub", "defines.h"), "#ifndef PROD#\n#define DEBUG#\n#endif#\n#include ../more.h#\n")
+        self.write("more.h", "#define MORE#\n")
+        content = "#include sub/defines.h#\n#ifdef DEBUG#\ndebug\n#endif#\n#ifdef MORE#\nmore\n#endif#\n"
+
+        result, file_context = self.process(content)
+        self.assertEqual(result, "debug\nmore\n")
+        self.assertEqual(set(file_context.included), {os.path.join(self.test_dir, "sub", "defines.h"),
+                                                      os.path.join(self.test_dir, "more.h")})
+
+        result, _ = self.process(content, {"PROD": True})
+        self.assertEqual(result, "more\n")
+
+
+    def test_include_inside_removed_block_is_ignored(self):
+        self.write("defines.h", "#define DEBUG#\n")
+        result, file_context = self.process("#ifdef A#\n#include defines.h#\n#endif#\n#ifndef DEBUG#\nprod\n#endif#\n")
+        self.assertEqual(result, "prod\n")
+        self.assertEqual(file_context.included, {})
+
+
+    def test_missing_and_circular_includes_are_errors(self):
+        self.write("a.h", "#include b.h#\n")
+        self.write("b.h", "#include a.h#\n#define B#\n")
+        with unittest.mock.patch.object(log, 'error') as error:
+            result, _ = self.process("#include missing.h#\n#include a.h#\n#ifdef B#\nb\n#endif#\n")
+        self.assertEqual(result, "#include missing.h#\nb\n")
+        self.assertEqual(error.call_count, 2)
@@ -25,7 +25,8 @@ import unittest
 from unittest.mock import patch
 import io
 import sys
-from src.log import Log
+import threading
+from src.log import Log, INFO, SUMMARY, ERROR
 
 
 class TestLog(unittest.TestCase):
@@ -36,15 +37,62 @@ class TestLog(unittest.TestCase):
     def test_info_verbose(self, mock_stdout):
         self.log.setVerbose(True)
         self.log.info("Test message")
+        self.log.flush()
         self.assertEqual(mock_stdout.getvalue(), "INFO: Test message\n")
 
 
     @patch('sys.stdout', new_callable=io.StringIO)
     def test_info_not_verbose(self, mock_stdout):
         self.log.info("Test message")
+        self.log.flush()
         self.assertEqual(mock_stdout.getvalue(), "")
 
 
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_info_is_buffered_until_flush(self, mock_stdout):
+        self.log.setVerbose(True)
+        self.log.info("Message 1")
+        self.log.info("Message 2")
+        self.assertEqual(mock_stdout.getvalue(), "")
+        self.log.flush()
+        self.assertEqual(mock_stdout.getvalue(), "INFO: Message 1\nINFO: Message 2\n")
+
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_error_flushes_buffered_info_first(self, mock_stdout):
+        self.log.setVerbose(True)
+        self.log.info("Info")
+        self.log.error("Error")
+        self.assertEqual(mock_stdout.getvalue(), "INFO: Info\nERROR: Error\n")
+
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_deferred_formatting(self, mock_stdout):
+        self.log.setVerbose(True)
+        self.log.info("Value %s, size %d", "abc", 3)
+        self.log.info(lambda: "from callable")
+        self.log.flush()
+        self.assertEqual(mock_stdout.getvalue(), "INFO: Value abc, size 3\nINFO: from callable\n")
+
+
+    def test_disabled_info_does_not_format(self):
+        def message():
+            raise AssertionError("message should not be built")
+        self.log.info(message)
+        self.log.info("%s %s", "too few args")
+
+
+    def test_is_enabled_for(self):
+        self.assertFalse(self.log.isEnabledFor(INFO))
+        self.assertTrue(self.log.isEnabledFor(ERROR))
+        self.log.setVerbose(True)
+        self.assertTrue(self.log.isEnabledFor(INFO))
+        self.log.setVerbose(False)
+        self.log.setSilent(True)
+        self.assertFalse(self.log.isEnabledFor(ERROR))
+        self.assertFalse(self.log.isEnabledFor(SUMMARY))
+
+
     @patch('sys.stdout', new_callable=io.StringIO)
     def test_error_not_silent(self, mock_stdout):
         self.log.error("Test error")
@@ -58,6 +106,19 @@ class TestLog(unittest.TestCase):
         self.assertEqual(mock_stdout.getvalue(), "")
 
 
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_summary_not_silent(self, mock_stdout):
+        self.log.summary("files = 1")
+        self.assertEqual(mock_stdout.getvalue(), "SUMMARY: files = 1\n")
+
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_summary_silent(self, mock_stdout):
+        self.log.setSilent(True)
+        self.log.summary("files = 1")
+        self.assertEqual(mock_stdout.getvalue(), "")
+
+
     @patch('sys.stdout', new_callable=io.StringIO)
     def test_fatal(self, mock_stdout):
         with self.assertRaises(SystemExit) as cm:
@@ -65,3 +126,38 @@ class TestLog(unittest.TestCase):
         self.assertEqual(cm.exception.code, 1)
         self.assertIn("!!! FATAL ERROR !!!", mock_stdout.getvalue())
         self.assertIn("message: Fatal error", mock_stdout.getvalue())
+
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_capture(self, mock_stdout):
+        self.log.setVerbose(True)
+        self.log.startCapture()
+        self.log.info("Captured")
+        self.log.error("Captured error")
+        captured = self.log.stopCapture()
+        self.log.info("Not captured")
+        self.log.flush()
+        self.assertEqual(captured, "INFO: Captured\nERROR: Captured error\n")
+        self.assertEqual(mock_stdout.getvalue(), "INFO: Not captured\n")
+
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_capture_is_per_thread(self, mock_stdout):
+        self.log.setVerbose(True)
+        self.log.startCapture()
+        thread = threading.Thread(target=lambda: self.log.info("Other thread"))
+        thread.start()
+        thread.join()
+        self.assertEqual(self.log.stopCapture(), "")
+        self.log.flush()
+        self.assertEqual(mock_stdout.getvalue(), "INFO: Other thread\n")
+
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_fatal_prints_captured_messages(self, mock_stdout):
+        self.log.setVerbose(True)
+        self.log.startCapture()
+        self.log.info("Before fatal")
+        with self.assertRaises(SystemExit):
+            self.log.fatal("Fatal error")
+        self.assertIn("INFO: Before fatal\n", mock_stdout.getvalue())
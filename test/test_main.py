@@ -0,0 +1,519 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import io
+import os
+from unittest.mock import patch
+import tempfile
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from src.main import run_full, run_watch, make_batches, run_parallel
+from src.stats import stats
+from src.config import Config, Variant
+from src.context import Context, context
+from src.log import log
+
+
+
+class TestRunFullVariants(unittest.TestCase):
+    def setUp(self):
+        # todo this is not threadsafe due to global context and config
+        context.reset()
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        Config.src_dir = os.path.join(self.test_dir, "in")
+        os.makedirs(os.path.join(Config.src_dir, "sub"))
+        with open(os.path.join(Config.src_dir, "sub", "file.js"), 'w') as f:
+            f.write("a\n// #ifdef PROD#\nb\n// #endif#\n// #ifndef PROD#\nc\n// #endif#\n")
+        with open(os.path.join(Config.src_dir, "plain.txt"), 'w') as f:
+            f.write("no directives here")
+
+
+    def tearDown(self):
+        context.reset()
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def read(self, *path):
+        with open(os.path.join(self.test_dir, *path), 'r') as f:
+            return f.read()
+
+
+    def test_each_variant_gets_its_own_output(self):
+        Config.jobs = 1
+        Config.variants = [
+            Variant("PROD", os.path.join(self.test_dir, "prod"), Context({"PROD": True})),
+            Variant("DEV", os.path.join(self.test_dir, "dev"), Context()),
+        ]
+        run_full()
+        self.assertEqual(self.read("prod", "sub", "file.js"), "a\nb\n")
+        self.assertEqual(self.read("dev", "sub", "file.js"), "a\nc\n")
+        self.assertEqual(self.read("prod", "plain.txt"), "no directives here")
+        self.assertEqual(self.read("dev", "plain.txt"), "no directives here")
+
+
+
+class TestRunFullSync(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        Config.src_dir = os.path.join(self.test_dir, "in")
+        Config.variants = [Variant("", os.path.join(self.test_dir, "out"), Context({"A": True}))]
+        Config.sync = True
+        Config.jobs = 1
+        os.makedirs(Config.src_dir)
+        self.write("in", "same.txt", "a\n#ifdef A#\nb\n#endif#\n")
+        self.write("in", "changed.txt", "old")
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        Config.sync = False
+        Config.jobs = os.cpu_count() or 1
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, *path_and_content):
+        *path, content = path_and_content
+        os.makedirs(os.path.join(self.test_dir, *path[:-1]), exist_ok=True)
+        with open(os.path.join(self.test_dir, *path), 'w') as f:
+            f.write(content)
+
+
+    def test_binary_files_are_passed_through(self):
+        data = b"\x89PNG\r\n\x1a\n\0\xff#ifdef A#"
+        with open(os.path.join(self.test_dir, "in", "image.png"), 'wb') as f:
+            f.write(data)
+        with open(os.path.join(self.test_dir, "in", "blob"), 'wb') as f:
+            f.write(b"\xff\xfe\0")
+        run_full()
+        self.assertEqual(stats.get("files_passed_through"), 2)
+        self.assertEqual(stats.get("files"), 2)
+        with open(os.path.join(self.test_dir, "out", "image.png"), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        run_full()
+        self.assertEqual(stats.get("outputs_unchanged"), 4)
+
+
+    def test_unchanged_outputs_are_hardlinked(self):
+        Config.sync = False
+        Config.unchanged_output = "hardlink"
+        try:
+            run_full()
+        finally:
+            Config.unchanged_output = "write"
+        self.assertEqual(stats.get("outputs_linked"), 1)
+        self.assertEqual(os.stat(os.path.join(self.test_dir, "in", "changed.txt")).st_ino,
+                         os.stat(os.path.join(self.test_dir, "out", "changed.txt")).st_ino)
+        with open(os.path.join(self.test_dir, "out", "same.txt")) as f:
+            self.assertEqual(f.read(), "a\nb\n")
+
+
+    def test_large_files_are_streamed(self):
+        Config.stream_threshold = 10
+        try:
+            run_full()
+            self.assertEqual(stats.get("files_streamed"), 1)
+            self.assertEqual(stats.get("files"), 2)
+            with open(os.path.join(self.test_dir, "out", "same.txt")) as f:
+                self.assertEqual(f.read(), "a\nb\n")
+
+            run_full()
+            self.assertEqual(stats.get("outputs_unchanged"), 2)
+        finally:
+            Config.stream_threshold = 256 * 1024 * 1024
+        self.assertEqual(sorted(os.listdir(os.path.join(self.test_dir, "out"))), ["changed.txt", "same.txt"])
+
+
+    def test_any_encoding_and_line_ends_are_kept(self):
+        Config.sync = False
+        content = "caf\u00e9\r\n#ifdef A#\r\n\u00e0 bient\u00f4t\r\n#endif#\r\n#ifdef B#\r\nb\r\n#endif#\r\n".encode("cp1252")
+        with open(os.path.join(self.test_dir, "in", "page.js"), 'wb') as f:
+            f.write(content)
+        # big files are memory mapped
+        Config.mmap = True
+        try:
+            with patch("src.file_system.MMAP_MIN_BYTES", 1):
+                run_full()
+        finally:
+            Config.mmap = False
+        with open(os.path.join(self.test_dir, "out", "page.js"), 'rb') as f:
+            self.assertEqual(f.read(), "caf\u00e9\r\n\u00e0 bient\u00f4t\r\n".encode("cp1252"))
+
+
+    def test_text_in_other_encoding_with_unknown_extension_is_processed(self):
+        with open(os.path.join(self.test_dir, "in", "app.tpl"), 'wb') as f:
+            f.write("d\u00e9but\n#ifdef PROD#\nsecret\n#endif#\nfin\n".encode("latin-1"))
+        run_full()
+        self.assertEqual(stats.get("files_passed_through"), 0)
+        with open(os.path.join(self.test_dir, "out", "app.tpl"), 'rb') as f:
+            self.assertEqual(f.read(), "d\u00e9but\nfin\n".encode("latin-1"))
+
+
+    def test_only_changed_outputs_are_written_and_orphans_removed(self):
+        run_full()
+        same_output = os.path.join(self.test_dir, "out", "same.txt")
+        os.utime(same_output, ns=(10 ** 18, 10 ** 18))
+        self.write("in", "changed.txt", "new")
+        self.write("out", "orphan_dir", "orphan.txt", "orphan")
+
+        run_full()
+        self.assertEqual(os.stat(same_output).st_mtime_ns, 10 ** 18)
+        self.assertEqual(stats.get("outputs_unchanged"), 1)
+        self.assertEqual(stats.get("orphans_removed"), 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.test_dir, "out"))), ["changed.txt", "same.txt"])
+        with open(os.path.join(self.test_dir, "out", "changed.txt")) as f:
+            self.assertEqual(f.read(), "new")
+
+
+
+class TestRunFullParallel(unittest.TestCase):
+    def setUp(self):
+        # todo this is not threadsafe due to global context and config
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        Config.src_dir = os.path.join(self.test_dir, "in")
+        for i in range(30):
+            os.makedirs(os.path.join(Config.src_dir, f"dir{i % 4}"), exist_ok=True)
+            with open(os.path.join(Config.src_dir, f"dir{i % 4}", f"file{i}.js"), 'w') as f:
+                f.write(f"start {i}\n" * i + f"// #ifdef V{i % 3}#\nv\n// #endif#\nend")
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        Config.jobs = os.cpu_count() or 1
+        shutil.rmtree(self.test_dir)
+
+
+    def run_with_jobs(self, jobs, target):
+        Config.jobs = jobs
+        Config.variants = [Variant("", os.path.join(self.test_dir, target), Context({"V1": True}))]
+        run_full()
+        outputs = {}
+        for dirpath, _, filenames in os.walk(os.path.join(self.test_dir, target)):
+            for filename in filenames:
+                with open(os.path.join(dirpath, filename), 'r') as f:
+                    outputs[filename] = f.read()
+        return outputs, stats.summary()
+
+
+    def test_parallel_run_gives_same_result_as_single_process(self):
+        single, single_summary = self.run_with_jobs(1, "out1")
+        parallel, parallel_summary = self.run_with_jobs(3, "out3")
+        self.assertEqual(len(single), 30)
+        self.assertEqual(single, parallel)
+        self.assertEqual(single_summary, parallel_summary)
+        self.assertEqual(single["file4.js"], "start 4\n" * 4 + "v\nend")
+
+
+    def test_parallel_run_log_output_is_in_crawl_order(self):
+        log.setSilent(False)
+        log.setVerbose(True)
+        try:
+            with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout:
+                self.run_with_jobs(1, "out")
+                log.flush()
+                single = mock_stdout.getvalue()
+            # several windows of crawled files
+            with patch('sys.stdout', new_callable=io.StringIO) as mock_stdout, patch("src.main.PARALLEL_WINDOW_FILES", 7):
+                self.run_with_jobs(4, "out")
+                log.flush()
+                parallel = mock_stdout.getvalue()
+        finally:
+            log.setVerbose(False)
+        self.assertIn("file29.js", single)
+        self.assertEqual(single, parallel)
+
+
+    def test_files_are_processed_while_more_are_crawled(self):
+        Config.variants = [Variant("", os.path.join(self.test_dir, "out"), Context({"V1": True}))]
+        files = sorted((os.path.join(dirpath, filename), os.path.join(dirpath, filename)[len(Config.src_dir):])
+                       for dirpath, _, filenames in os.walk(Config.src_dir) for filename in filenames)
+
+        def crawl():
+            for count, (file_path, relative_path) in enumerate(files):
+                if count == 4:
+                    # first window has to be processed before the crawl goes on
+                    first_output = os.path.join(self.test_dir, "out") + files[0][1]
+                    deadline = time.monotonic() + 10
+                    while not os.path.exists(first_output) and time.monotonic() < deadline:
+                        time.sleep(0.01)
+                    self.assertTrue(os.path.exists(first_output))
+                yield file_path, relative_path
+
+        with patch("src.main.PARALLEL_WINDOW_FILES", 4):
+            run_parallel(crawl(), 2)
+        self.assertEqual(sum(len(filenames) for _, _, filenames in os.walk(os.path.join(self.test_dir, "out"))), 30)
+
+
+    def test_verbose_output_does_not_depend_on_jobs(self):
+        # workers write to the real stdout of the process, anything printed outside of captured output shows up only there
+        with open(os.path.join(self.test_dir, "praprocessor.config.json"), 'w') as f:
+            f.write('{"src_dir": "in", "target_dir": "out", "#define": ["V1"]}')
+        run_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "run.py")
+        outputs = []
+        for jobs in ["1", "4"]:
+            result = subprocess.run([sys.executable, run_script, self.test_dir, "--verbose", "--jobs", jobs],
+                                    capture_output=True, text=True, check=True)
+            outputs.append(result.stdout)
+        self.assertIn("file29.js", outputs[0])
+        self.assertNotIn("ERROR", outputs[1])
+        self.assertEqual(outputs[0], outputs[1])
+
+
+class TestRunFullIncremental(unittest.TestCase):
+    def setUp(self):
+        # todo this is not threadsafe due to global context and config
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        Config.src_dir = os.path.join(self.test_dir, "in")
+        Config.variants = [Variant("", os.path.join(self.test_dir, "out"), Context({"A": True}))]
+        Config.incremental = True
+        Config.manifest_path = os.path.join(self.test_dir, "state", "manifest.json")
+        Config.jobs = 1
+        os.makedirs(Config.src_dir)
+        for i in range(3):
+            self.write(os.path.join(Config.src_dir, f"file{i}.txt"), f"file {i}\n#ifdef A#\na\n#endif#\n")
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        Config.incremental = False
+        Config.jobs = os.cpu_count() or 1
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+    def test_only_changed_files_are_processed(self):
+        run_full()
+        self.assertEqual(stats.get("files"), 3)
+
+        run_full()
+        self.assertEqual(stats.get("files"), 0)
+        self.assertEqual(stats.get("files_up_to_date"), 3)
+
+        self.write(os.path.join(Config.src_dir, "file1.txt"), "changed, longer content")
+        os.remove(os.path.join(Config.src_dir, "file2.txt"))
+        run_full()
+        self.assertEqual(stats.get("files"), 1)
+        self.assertEqual(stats.get("files_removed"), 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.test_dir, "out"))), ["file0.txt", "file1.txt"])
+        with open(os.path.join(self.test_dir, "out", "file1.txt")) as f:
+            self.assertEqual(f.read(), "changed, longer content")
+
+
+    def test_streamed_files_are_recorded_in_manifest(self):
+        Config.stream_threshold = 1
+        try:
+            run_full()
+            self.assertEqual(stats.get("files_streamed"), 3)
+            # touched files are compared by content hash, it has to be the same as for files read as a whole
+            os.utime(os.path.join(Config.src_dir, "file0.txt"), ns=(10 ** 18, 10 ** 18))
+            Config.stream_threshold = 256 * 1024 * 1024
+            run_full()
+        finally:
+            Config.stream_threshold = 256 * 1024 * 1024
+        self.assertEqual(stats.get("files_up_to_date"), 3)
+
+
+    def test_changed_defines_reprocess_files(self):
+        run_full()
+        Config.variants = [Variant("", os.path.join(self.test_dir, "out"), Context({}))]
+        run_full()
+        self.assertEqual(stats.get("files"), 3)
+        with open(os.path.join(self.test_dir, "out", "file0.txt")) as f:
+            self.assertEqual(f.read(), "file 0\n")
+
+
+    def test_only_files_checking_changed_define_are_processed(self):
+        self.write(os.path.join(Config.src_dir, "other.txt"), "#ifdef ANALYTICS#\nanalytics\n#endif#\n")
+        run_full()
+        Config.variants = [Variant("", os.path.join(self.test_dir, "out"), Context({"A": True, "ANALYTICS": True}))]
+        run_full()
+        self.assertEqual(stats.get("files"), 1)
+        self.assertEqual(stats.get("files_up_to_date"), 3)
+        with open(os.path.join(self.test_dir, "out", "other.txt")) as f:
+            self.assertEqual(f.read(), "analytics\n")
+
+
+    def test_files_including_changed_header_are_processed(self):
+        self.write(os.path.join(Config.src_dir, "defines.h"), "#define B#\n")
+        self.write(os.path.join(Config.src_dir, "file0.txt"), "#include defines.h#\n#ifdef B#\nb\n#endif#\n")
+        run_full()
+        with open(os.path.join(self.test_dir, "out", "file0.txt")) as f:
+            self.assertEqual(f.read(), "b\n")
+
+        self.write(os.path.join(Config.src_dir, "defines.h"), "#define C#\n")
+        run_full()
+        self.assertEqual(stats.get("files"), 2)
+        with open(os.path.join(self.test_dir, "out", "file0.txt")) as f:
+            self.assertEqual(f.read(), "")
+
+
+
+class TestRunFullOutputCache(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        Config.src_dir = os.path.join(self.test_dir, "in")
+        Config.cache_dir = os.path.join(self.test_dir, "cache")
+        Config.jobs = 1
+        os.makedirs(Config.src_dir)
+        self.write("file.txt", "a\n#ifdef A#\nb\n#endif#\n#include defines.h#\n#ifdef C#\nc\n#endif#\n")
+        self.write("plain.txt", "no directives")
+        self.write("defines.h", "#define C#\n")
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        Config.cache_dir = None
+        Config.jobs = os.cpu_count() or 1
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, relative_path, content):
+        with open(os.path.join(Config.src_dir, relative_path), 'w') as f:
+            f.write(content)
+
+
+    def run_into(self, target, global_context):
+        Config.variants = [Variant("", os.path.join(self.test_dir, target), Context(global_context))]
+        run_full()
+        with open(os.path.join(self.test_dir, target, "file.txt")) as f:
+            return f.read()
+
+
+    def test_other_checkout_uses_cached_output(self):
+        self.assertEqual(self.run_into("out1", {"A": True}), "a\nb\nc\n")
+        self.assertEqual((stats.get("cache_hits"), stats.get("cache_misses")), (0, 2))
+
+        self.assertEqual(self.run_into("out2", {"A": True}), "a\nb\nc\n")
+        self.assertEqual((stats.get("cache_hits"), stats.get("cache_misses")), (2, 0))
+
+        # defines.h checks no variable, so only file.txt is processed again
+        self.assertEqual(self.run_into("out3", {}), "a\nc\n")
+        self.assertEqual((stats.get("cache_hits"), stats.get("cache_misses")), (1, 1))
+
+        self.assertEqual(self.run_into("out4", {"A": True, "ANALYTICS": True}), "a\nb\nc\n")
+        self.assertEqual((stats.get("cache_hits"), stats.get("cache_misses")), (2, 0))
+
+
+    def test_cached_output_is_not_used_when_included_file_changed(self):
+        self.run_into("out1", {})
+        self.write("defines.h", "#define D#\n")
+        self.assertEqual(self.run_into("out2", {}), "a\n")
+        self.assertEqual(stats.get("cache_misses"), 2)
+
+
+
+class TestRunWatch(unittest.TestCase):
+    def setUp(self):
+        # todo this is not threadsafe due to global context and config
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        Config.src_dir = os.path.join(self.test_dir, "in")
+        Config.variants = [Variant("", os.path.join(self.test_dir, "out"), Context({"A": True}))]
+        os.makedirs(Config.src_dir)
+        os.makedirs(os.path.join(self.test_dir, "out"))
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=run_watch, args=(self.stop_event,))
+        self.thread.start()
+        time.sleep(0.1)
+
+
+    def tearDown(self):
+        self.stop_event.set()
+        self.thread.join()
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def read(self, path):
+        with open(path, 'r') as f:
+            return f.read()
+
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+
+    def test_changed_file_is_processed_and_removed_file_is_removed(self):
+        target = os.path.join(self.test_dir, "out", "sub", "file.txt")
+        os.makedirs(os.path.join(Config.src_dir, "sub"))
+        with open(os.path.join(Config.src_dir, "sub", "file.txt"), 'w') as f:
+            f.write("a\n#ifndef A#\nb\n#endif#\n")
+        self.assertTrue(self.wait_for(lambda: os.path.exists(target)))
+        self.assertTrue(self.wait_for(lambda: self.read(target) == "a\n"))
+
+        os.remove(os.path.join(Config.src_dir, "sub", "file.txt"))
+        self.assertTrue(self.wait_for(lambda: not os.path.exists(target)))
+
+
+    def test_files_including_changed_header_are_processed(self):
+        target = os.path.join(self.test_dir, "out", "file.txt")
+        with open(os.path.join(Config.src_dir, "defines.h"), 'w') as f:
+            f.write("#define B#\n")
+        with open(os.path.join(Config.src_dir, "file.txt"), 'w') as f:
+            f.write("#include defines.h#\n#ifdef B#\nb\n#endif#\n")
+        self.assertTrue(self.wait_for(lambda: os.path.exists(target) and self.read(target) == "b\n"))
+
+        with open(os.path.join(Config.src_dir, "defines.h"), 'w') as f:
+            f.write("")
+        self.assertTrue(self.wait_for(lambda: self.read(target) == ""))
+
+
+    def test_burst_of_changes_is_processed(self):
+        for i in range(50):
+            for content in ["old\n", "a\n#ifndef A#\nb\n#endif#\n"]:
+                with open(os.path.join(Config.src_dir, f"file{i}.txt"), 'w') as f:
+                    f.write(content)
+        targets = [os.path.join(self.test_dir, "out", f"file{i}.txt") for i in range(50)]
+        self.assertTrue(self.wait_for(lambda: all(os.path.exists(target) and self.read(target) == "a\n" for target in targets)))
+
+
+
+class TestMakeBatches(unittest.TestCase):
+    def test_biggest_files_go_first(self):
+        files = [(0, "a", "/a", 10), (1, "b", "/b", 5 * 1024 * 1024), (2, "c", "/c", 20)]
+        batches = make_batches(files)
+        self.assertEqual(batches[0], [(1, "b", "/b")])
+        self.assertEqual(batches[1], [(2, "c", "/c"), (0, "a", "/a")])
+
+    def test_batch_size_is_limited(self):
+        files = [(i, "f", "/f", 1) for i in range(200)]
+        batches = make_batches(files)
+        self.assertEqual(sum(len(batch) for batch in batches), 200)
+        self.assertTrue(all(len(batch) <= 64 for batch in batches))
@@ -0,0 +1,127 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import os
+import tempfile
+import shutil
+from src.manifest import Manifest, content_hash, defines_fingerprint
+from src.config import Variant
+from src.context import Context
+from src.log import log
+
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.test_dir, "source.txt")
+        self.output = os.path.join(self.test_dir, "output.txt")
+        self.write(self.source, "content")
+        self.write(self.output, "output")
+        self.manifest = Manifest(os.path.join(self.test_dir, "state", "manifest.json"))
+
+
+    def tearDown(self):
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+    def record_source(self):
+        self.manifest.record("/source.txt", os.stat(self.source), "fp", content_hash("content"), [self.output])
+
+
+    def test_load_missing_manifest(self):
+        self.assertFalse(self.manifest.load())
+        self.assertEqual(self.manifest.files, {})
+
+
+    def test_save_and_load(self):
+        self.record_source()
+        self.manifest.save()
+        loaded = Manifest(self.manifest.path)
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.files, self.manifest.files)
+
+
+    def test_broken_manifest_is_not_loaded(self):
+        os.makedirs(os.path.dirname(self.manifest.path))
+        self.write(self.manifest.path, "{not json")
+        self.assertFalse(self.manifest.load())
+
+
+    def test_unchanged_file_is_up_to_date_without_reading(self):
+        self.record_source()
+        def read_content():
+            raise AssertionError("content should not be read")
+        self.assertTrue(self.manifest.is_up_to_date("/source.txt", os.stat(self.source), "fp", read_content))
+
+
+    def test_touched_file_with_same_content_is_up_to_date(self):
+        self.record_source()
+        stat_result = os.stat(self.source)
+        os.utime(self.source, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10 ** 9))
+        self.assertTrue(self.manifest.is_up_to_date("/source.txt", os.stat(self.source), "fp", lambda: "content"))
+
+
+    def test_changed_file_is_not_up_to_date(self):
+        self.record_source()
+        self.write(self.source, "CONTENT")
+        stat_result = os.stat(self.source)
+        os.utime(self.source, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10 ** 9))
+        self.assertFalse(self.manifest.is_up_to_date("/source.txt", os.stat(self.source), "fp", lambda: "CONTENT"))
+
+
+    def test_other_fingerprint_or_missing_output_is_not_up_to_date(self):
+        self.record_source()
+        self.assertFalse(self.manifest.is_up_to_date("/source.txt", os.stat(self.source), "other", lambda: "content"))
+        os.remove(self.output)
+        self.assertFalse(self.manifest.is_up_to_date("/source.txt", os.stat(self.source), "fp", lambda: "content"))
+
+
+    def test_forget_missing_removes_outputs(self):
+        self.record_source()
+        self.assertEqual(self.manifest.forget_missing(set()), 1)
+        self.assertEqual(self.manifest.files, {})
+        self.assertFalse(os.path.exists(self.output))
+
+
+    def test_record_removes_outputs_not_produced_again(self):
+        self.record_source()
+        other_output = os.path.join(self.test_dir, "other.txt")
+        self.manifest.record("/source.txt", os.stat(self.source), "fp", content_hash("content"), [other_output])
+        self.assertFalse(os.path.exists(self.output))
+
+
+    def test_defines_fingerprint(self):
+        first = defines_fingerprint([Variant("", "out", Context({"A": True, "B": False}))])
+        same = defines_fingerprint([Variant("", "out", Context({"A": True}))])
+        other = defines_fingerprint([Variant("", "out", Context({"A": True, "B": True}))])
+        self.assertEqual(first, same)
+        self.assertNotEqual(first, other)
@@ -0,0 +1,66 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import os
+import tempfile
+import shutil
+from src.output_cache import OutputCache, cache_key, variables_key
+
+
+
+class TestOutputCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache = OutputCache(self.test_dir, 1024)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+    def test_key_depends_on_content_and_checked_variables(self):
+        key = cache_key("hash", ["A", "B"], {"A": True, "B": False, "C": True})
+        self.assertEqual(key, cache_key("hash", ["B", "A"], {"A": True}))
+        self.assertNotEqual(key, cache_key("other hash", ["A", "B"], {"A": True}))
+        self.assertNotEqual(key, cache_key("hash", ["A", "B"], {"A": True, "B": True}))
+        self.assertNotEqual(key, cache_key("hash", ["A"], {"A": True}))
+        self.assertNotEqual(variables_key("hash"), variables_key("other hash"))
+
+
+    def test_stored_entry_is_found(self):
+        key = cache_key("hash", [], {})
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.put(key, {'spans': [(0, 4), (10, 12)]})
+        self.assertEqual(self.cache.get(key), {'spans': [[0, 4], [10, 12]]})
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, key[:2])), [key + ".json"])
+
+
+    def test_least_recently_used_entries_are_evicted(self):
+        keys = [cache_key(str(i), [], {}) for i in range(10)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, {'spans': [(0, 1)] * 20, 'includes': {}})
+            os.utime(self.cache.entry_path(key), ns=(i * 10 ** 9, i * 10 ** 9))
+        self.assertEqual(self.cache.evict(), 6)
+        self.assertEqual([self.cache.get(key) != None for key in keys], [False] * 6 + [True] * 4)
+        self.assertEqual(self.cache.evict(), 0)
@@ -0,0 +1,113 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import os
+import tempfile
+import shutil
+from src.path_filter import PathFilter, translate_pattern, parse_gitignore
+from src.file_system import list_files_recursive
+
+
+
+class TestPathFilter(unittest.TestCase):
+    def test_pattern_without_slash_matches_at_any_depth(self):
+        path_filter = PathFilter(exclude = ["*.min.js", "node_modules"])
+        self.assertTrue(path_filter.is_excluded("app.min.js"))
+        self.assertTrue(path_filter.is_excluded("lib/app.min.js"))
+        self.assertTrue(path_filter.is_excluded("web/node_modules", True))
+        self.assertFalse(path_filter.is_excluded("app.js"))
+
+
+    def test_pattern_with_slash_is_relative_to_root(self):
+        path_filter = PathFilter(exclude = ["/build", "docs/*.md", "a/**/z"])
+        self.assertTrue(path_filter.is_excluded("build", True))
+        self.assertFalse(path_filter.is_excluded("web/build", True))
+        self.assertTrue(path_filter.is_excluded("docs/readme.md"))
+        self.assertFalse(path_filter.is_excluded("docs/api/readme.md"))
+        self.assertTrue(path_filter.is_excluded("a/z"))
+        self.assertTrue(path_filter.is_excluded("a/b/c/z"))
+
+
+    def test_directory_only_pattern(self):
+        path_filter = PathFilter(exclude = ["cache/"])
+        self.assertTrue(path_filter.is_excluded("cache", True))
+        self.assertFalse(path_filter.is_excluded("cache"))
+
+
+    def test_last_matching_pattern_wins(self):
+        path_filter = PathFilter(exclude = ["*.log", "!important.log", "logs/important.log"])
+        self.assertTrue(path_filter.is_excluded("debug.log"))
+        self.assertFalse(path_filter.is_excluded("important.log"))
+        self.assertTrue(path_filter.is_excluded("logs/important.log"))
+        self.assertEqual(len(path_filter.segments), 3)
+
+
+    def test_include_patterns(self):
+        path_filter = PathFilter(include = ["*.js", "/static/**"], exclude = ["vendor/"])
+        self.assertTrue(path_filter.accepts_file("src/app.js"))
+        self.assertTrue(path_filter.accepts_file("static/img/logo.png"))
+        self.assertFalse(path_filter.accepts_file("src/logo.png"))
+        self.assertFalse(path_filter.accepts_path("vendor/lib.js"))
+        self.assertTrue(path_filter.accepts_path("/src/app.js"))
+
+
+    def test_character_classes(self):
+        self.assertEqual(translate_pattern("file[!0-9].txt"), r"(?:.*/)?file[^0-9]\.txt")
+        path_filter = PathFilter(exclude = ["file[0-9].txt"])
+        self.assertTrue(path_filter.is_excluded("file1.txt"))
+        self.assertFalse(path_filter.is_excluded("fileA.txt"))
+
+
+    def test_parse_gitignore(self):
+        content = "# comment\n\n*.log\nspace\\ \ntrailing   \n\\#hash\n"
+        self.assertEqual(parse_gitignore(content), ["*.log", "space ", "trailing", "#hash"])
+
+
+
+class TestListFilesRecursiveWithFilter(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        for relative_path in ["a.js", "a.log", os.path.join("node_modules", "lib", "x.js"), os.path.join("src", "b.js"),
+                              os.path.join("src", "node_modules", "y.js")]:
+            os.makedirs(os.path.dirname(os.path.join(self.test_dir, relative_path)), exist_ok=True)
+            with open(os.path.join(self.test_dir, relative_path), 'w') as f:
+                f.write("")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+    def test_excluded_directories_are_pruned(self):
+        checked = []
+
+        class RecordingFilter(PathFilter):
+            def is_excluded(self, relative_path, is_dir = False):
+                checked.append(relative_path)
+                return super().is_excluded(relative_path, is_dir)
+
+        files = list_files_recursive(self.test_dir, RecordingFilter(exclude = ["node_modules/", "*.log"]))
+        self.assertEqual(sorted(relative_path for _, relative_path in files),
+                         [os.sep + "a.js", os.path.join(os.sep + "src", "b.js")])
+        self.assertFalse(any(path.startswith("node_modules/") for path in checked))
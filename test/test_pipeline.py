@@ -0,0 +1,139 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import io
+import os
+import tempfile
+import shutil
+import threading
+import time
+from unittest.mock import patch
+from src.pipeline import ByteBudget, run_pipeline
+from src.log import log
+
+
+
+class TestByteBudget(unittest.TestCase):
+    def test_acquire_blocks_until_release(self):
+        budget = ByteBudget(10)
+        budget.acquire(8)
+        acquired = threading.Event()
+
+        def acquire_more():
+            budget.acquire(5)
+            acquired.set()
+
+        thread = threading.Thread(target=acquire_more)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        budget.release(8)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+        self.assertEqual(budget.in_flight, 5)
+
+    def test_item_bigger_than_budget_goes_alone(self):
+        budget = ByteBudget(10)
+        budget.acquire(100)
+        self.assertEqual(budget.in_flight, 100)
+
+
+
+class TestRunPipeline(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(40):
+            file_path = os.path.join(self.test_dir, f"file{i}.txt")
+            with open(file_path, 'w') as f:
+                f.write("x" * (i + 1))
+            self.files.append((file_path, f"/file{i}.txt"))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+    def test_files_are_processed_in_order_and_all_written(self):
+        processed = []
+        written = {}
+
+        def process(content, relative_path):
+            processed.append(relative_path)
+            return len(content)
+
+        def write(content, result):
+            written[result] = content
+
+        run_pipeline(self.files, process, write, read_threads=4, write_threads=3, max_in_flight_bytes=1024)
+        self.assertEqual(processed, [relative_path for _, relative_path in self.files])
+        self.assertEqual(sorted(written), list(range(1, 41)))
+
+
+    def test_in_flight_bytes_are_limited(self):
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def process(content, relative_path):
+            with lock:
+                in_flight[0] += len(content)
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            return None
+
+        def write(content, result):
+            time.sleep(0.001)
+            with lock:
+                in_flight[0] -= len(content)
+
+        run_pipeline(self.files, process, write, read_threads=4, write_threads=4, max_in_flight_bytes=100)
+        self.assertLessEqual(in_flight[1], 100)
+        self.assertEqual(in_flight[0], 0)
+
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_log_output_is_in_file_order(self, mock_stdout):
+        def process(content, relative_path):
+            log.error(f"process {relative_path}")
+            return relative_path
+
+        def write(content, result):
+            time.sleep(0.001 * (hash(result) % 3))
+            log.error(f"write {result}")
+
+        run_pipeline(self.files, process, write, read_threads=4, write_threads=4, max_in_flight_bytes=1024)
+        log.flush()
+        expected = "".join(f"ERROR: process {path}\nERROR: write {path}\n" for _, path in self.files)
+        self.assertEqual(mock_stdout.getvalue(), expected)
+
+
+    def test_failing_file_does_not_stop_processing(self):
+        processed = []
+        files = self.files[:3] + [(os.path.join(self.test_dir, "missing.txt"), "/missing.txt")] + self.files[3:6]
+        log.setSilent(True)
+        try:
+            run_pipeline(files, lambda content, relative_path: processed.append(relative_path), lambda content, result: None,
+                         read_threads=2, write_threads=1, max_in_flight_bytes=1024)
+        finally:
+            log.setSilent(False)
+        self.assertEqual(len(processed), 6)
+        self.assertNotIn("/missing.txt", processed)
@@ -0,0 +1,237 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import threading
+from src.processor import process_single_file, process_single_file_spans, has_directives, get_kept_spans, compile_file, process_lines
+from src.context import Context, context
+from src.stats import stats
+from src.log import log
+
+
+
+class TestProcessSingleFile(unittest.TestCase):
+    def setUp(self):
+        # todo this is not threadsafe
+        context.reset()
+        stats.reset()
+        log.setSilent(True)
+
+    def tearDown(self):
+        context.reset()
+        stats.reset()
+        log.setSilent(False)
+
+
+    def test_has_directives(self):
+        self.assertTrue(has_directives("a\n// #ifdef A#\nb\n// #endif#"))
+        self.assertFalse(has_directives("a\n#fff\n# ifdef\nb"))
+        self.assertFalse(has_directives(""))
+
+
+    def test_define_sets_local_variable_only_outside_removed_blocks(self):
+        content = "#ifdef A#\n#define B#\n#endif#\n#define C=10#\n#ifdef B#\nb\n#endif#\n#ifdef C#\nc\n#endif#\n"
+        self.assertEqual(process_single_file(content, Context({}).new_file_context()), "c\n")
+        self.assertEqual(process_single_file(content, Context({"A": True}).new_file_context()), "b\nc\n")
+
+
+    def test_file_without_directives_takes_fast_path(self):
+        content = "line 1\r\nline #2\n\nline 3\n"
+        result = process_single_file(content)
+        self.assertIs(result, content)
+        self.assertEqual(stats.get("files_fast_path"), 1)
+
+
+    def test_file_with_directives_does_not_take_fast_path(self):
+        content = "a\n#ifdef A#\nb\n#endif#\nc"
+        self.assertEqual(process_single_file(content), "a\nc")
+        self.assertEqual(stats.get("files_fast_path"), 0)
+
+
+    def test_defined_variable_keeps_code(self):
+        context.set_global_variable("A", True)
+        content = "a\n#ifdef A#\nb\n#endif#\n#ifndef A#\nc\n#endif#\nd\n"
+        self.assertEqual(process_single_file(content), "a\nb\nd\n")
+
+
+    def test_no_fast_path_inside_unclosed_ifdef(self):
+        process_single_file("#ifdef A#\n")
+        self.assertEqual(process_single_file("a\nb"), "")
+        self.assertEqual(stats.get("files_fast_path"), 0)
+
+
+
+class TestGetKeptSpans(unittest.TestCase):
+    def setUp(self):
+        # todo this is not threadsafe
+        context.reset()
+        log.setSilent(True)
+
+    def tearDown(self):
+        context.reset()
+        log.setSilent(False)
+
+
+    def test_spans_skip_directive_lines_and_ifdefed_block(self):
+        content = "a\nb\n#ifdef A#\nc\n#endif#\nd\ne"
+        spans = get_kept_spans(content)
+        self.assertEqual(spans, [(0, 4), (24, 27)])
+        self.assertEqual("".join(content[s:e] for s, e in spans), "a\nb\nd\ne")
+
+
+    def test_defined_block_spans(self):
+        context.set_global_variable("A", True)
+        content = "a\n#ifdef A#\nb\n#endif#\nc\n"
+        self.assertEqual(get_kept_spans(content), [(0, 2), (12, 14), (22, 24)])
+
+
+    def test_adjacent_kept_regions_are_merged(self):
+        content = "a\n#ifdef#\nb\n#endif#\nc"
+        self.assertEqual(get_kept_spans(content), [(0, 12), (20, 21)])
+
+
+    def test_dropped_last_line_removes_trailing_separator(self):
+        self.assertEqual(process_single_file("a\nb\n#ifdef A#"), "a\nb")
+        context.reset()
+        self.assertEqual(process_single_file("a\n#ifdef A#\nb\n"), "a")
+        context.reset()
+        self.assertEqual(process_single_file("#ifdef A#\nb\n"), "")
+
+
+    def test_invalid_directive_line_is_kept(self):
+        content = "a\n#ifdef#\nb"
+        self.assertEqual(process_single_file(content), content)
+
+
+    def test_fast_path_spans_cover_whole_content(self):
+        self.assertEqual(process_single_file_spans("abc\n"), [(0, 4)])
+        self.assertEqual(process_single_file_spans(""), [(0, 0)])
+
+
+
+class TestCompiledFile(unittest.TestCase):
+    def setUp(self):
+        # todo this is not threadsafe
+        context.reset()
+        log.setSilent(True)
+
+    def tearDown(self):
+        context.reset()
+        log.setSilent(False)
+
+
+    def test_instructions_are_directive_lines_only(self):
+        compiled = compile_file("a\n// #ifdef A#\nb\n// #endif#\nc")
+        self.assertEqual(compiled.instructions, [
+            (2, 14, "#ifdef", " A#", "A"),
+            (17, 27, "#endif", "#", ""),
+        ])
+        self.assertEqual(compiled.variables(), {"A"})
+
+
+    def test_streamed_lines_give_the_same_output_as_whole_content(self):
+        contents = [
+            "", "\n", "a", "a\n", "a\r\nb\r\n",
+            "a\n#ifdef A#\nb\n#endif#\nc",
+            "a\n#ifdef B#\nb\n#endif#\n",
+            "a\n#ifdef B#\nb\n#endif#",
+            "a\n#ifdef B#\nb\n",
+            "#ifdef B#\nb\n#endif#\n#ifdef A#\na",
+            "a\n#ifdef A# #ifdef B#\nc\n#define B#\n#ifdef B#\nd\n#endif#\n",
+        ]
+        for content in contents:
+            lines = content.splitlines(keepends=True)
+            outputs = [[], []]
+            file_contexts = [Context({"A": True}).new_file_context(), Context({"B": True}).new_file_context()]
+            all_kept = process_lines(iter(lines), [output.append for output in outputs], file_contexts)
+            for output, global_context in zip(outputs, [{"A": True}, {"B": True}]):
+                expected = process_single_file(content, Context(global_context).new_file_context())
+                self.assertEqual("".join(output), expected, repr(content))
+            self.assertEqual(all_kept, all("".join(output) == content for output in outputs), repr(content))
+
+            byte_outputs = [[], []]
+            file_contexts = [Context({"A": True}).new_file_context(), Context({"B": True}).new_file_context()]
+            process_lines(iter(content.encode().splitlines(keepends=True)), [output.append for output in byte_outputs], file_contexts)
+            self.assertEqual([b"".join(output).decode() for output in byte_outputs], ["".join(output) for output in outputs])
+
+
+    def test_bytes_content_is_processed_without_decoding(self):
+        content = "za\u017c\u00f3\u0142\u0107\r\n// #ifdef A#\r\n\u00e9t\u00e9\r\n// #endif#\r\nend".encode("latin-1", "replace")
+        compiled = compile_file(content)
+        self.assertEqual(compiled.variables(), {"A"})
+        self.assertEqual(compiled.render(Context({"A": True}).new_file_context()),
+                         "za\u017c\u00f3\u0142\u0107\r\n\u00e9t\u00e9\r\nend".encode("latin-1", "replace"))
+        self.assertEqual(compiled.render(Context({}).new_file_context()), "za\u017c\u00f3\u0142\u0107\r\nend".encode("latin-1", "replace"))
+        self.assertTrue(has_directives(content))
+        self.assertFalse(has_directives(b"# ifdef\r\n\xff"))
+
+
+    def test_line_with_multiple_directives_is_compiled_as_unhandled(self):
+        compiled = compile_file("#ifdef A# #endif#")
+        self.assertEqual(compiled.instructions, [(0, 17, None, "", "")])
+        self.assertEqual(compiled.render(), "#ifdef A# #endif#")
+
+
+    def test_compile_once_evaluate_for_different_defines(self):
+        compiled = compile_file("a\n#ifdef A#\nb\n#endif#\n#ifndef B#\nc\n#endif#\n")
+        self.assertEqual(compiled.render(), "a\nc\n")
+
+        context.reset()
+        context.set_global_variable("A", True)
+        self.assertEqual(compiled.render(), "a\nb\nc\n")
+
+        context.reset()
+        context.set_global_variable("A", True)
+        context.set_global_variable("B", True)
+        self.assertEqual(compiled.render(), "a\nb\n")
+
+
+
+class TestConcurrentProcessing(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+
+    def tearDown(self):
+        log.setSilent(False)
+
+
+    def test_files_processed_concurrently_with_own_contexts(self):
+        content = "".join(f"#ifdef V{i}#\nline {i}\n#endif#\n" for i in range(20))
+        defined = Context({"V3": True, "V7": True})
+        expected = "line 3\nline 7\n"
+        results = []
+
+        def worker():
+            for _ in range(50):
+                file_context = defined.new_file_context()
+                results.append(process_single_file(content, file_context))
+                file_context.on_file_end()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 400)
+        self.assertTrue(all(result == expected for result in results))
+        self.assertEqual(defined.ifdef_stack, [])
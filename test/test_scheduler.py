@@ -0,0 +1,127 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import threading
+import time
+from src.scheduler import ChangeScheduler
+from src.log import log
+
+
+
+class TestChangeScheduler(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.batches = []
+
+
+    def tearDown(self):
+        log.setSilent(False)
+
+
+    def record(self, events, is_stale):
+        self.batches.append(events)
+
+
+    def test_events_are_coalesced_into_one_batch(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def handler(events, is_stale):
+            self.batches.append(events)
+            started.set()
+            release.wait()
+
+        scheduler = ChangeScheduler(handler, debounce = 0.05)
+        scheduler.add([("changed", "first")])
+        started.wait()
+        # events coming while a batch runs are collected for the next one
+        scheduler.add([("changed", "a"), ("changed", "b")])
+        scheduler.add([("removed", "a")])
+        release.set()
+        scheduler.wait_idle()
+        scheduler.stop()
+        self.assertEqual(self.batches, [[("changed", "first")], [("changed", "b"), ("removed", "a")]])
+
+
+    def test_single_event_starts_batch_without_debounce(self):
+        handled = threading.Event()
+        scheduler = ChangeScheduler(lambda events, is_stale: handled.set(), debounce = 10, max_delay = 10)
+        started = time.monotonic()
+        scheduler.add([("changed", "a")])
+        self.assertTrue(handled.wait(5))
+        self.assertLess(time.monotonic() - started, 1)
+        scheduler.stop()
+
+
+    def test_burst_is_debounced(self):
+        scheduler = ChangeScheduler(self.record, debounce = 0.2, max_delay = 10)
+        scheduler.add([("changed", "a")])
+        scheduler.wait_idle()
+        # follows the previous event within debounce - a burst is going on, its events are collected
+        scheduler.add([("changed", "b")])
+        scheduler.add([("changed", "c")])
+        scheduler.wait_idle()
+        scheduler.stop()
+        self.assertEqual(self.batches, [[("changed", "a")], [("changed", "b"), ("changed", "c")]])
+
+
+    def test_stop_processes_pending_events(self):
+        scheduler = ChangeScheduler(self.record, debounce = 60, max_delay = 60)
+        scheduler.add([("changed", "a")])
+        scheduler.stop()
+        self.assertEqual(self.batches, [[("changed", "a")]])
+
+
+    def test_path_changed_during_batch_is_stale_and_comes_again(self):
+        started = threading.Event()
+        resume = threading.Event()
+        stale = []
+
+        def handler(events, is_stale):
+            self.batches.append(events)
+            if len(self.batches) == 1:
+                started.set()
+                resume.wait()
+            stale.append([path for _, path in events if is_stale(path)])
+
+        scheduler = ChangeScheduler(handler, debounce = 0)
+        scheduler.add([("changed", "a"), ("changed", "b")])
+        started.wait()
+        scheduler.add([("changed", "a")])
+        resume.set()
+        scheduler.wait_idle()
+        scheduler.stop()
+        self.assertEqual(self.batches, [[("changed", "a"), ("changed", "b")], [("changed", "a")]])
+        self.assertEqual(stale, [["a"], []])
+        self.assertEqual(scheduler.generations, {})
+
+
+    def test_fatal_error_is_raised_in_watching_thread(self):
+        def handler(events, is_stale):
+            raise SystemExit(1)
+
+        scheduler = ChangeScheduler(handler, debounce = 0)
+        scheduler.add([("changed", "a")])
+        with self.assertRaises(SystemExit):
+            scheduler.wait_idle()
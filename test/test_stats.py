@@ -0,0 +1,52 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+from src.stats import Stats
+
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.stats = Stats()
+
+    def test_count_and_get(self):
+        self.stats.count("files")
+        self.stats.count("files")
+        self.stats.count("bytes", 10)
+        self.assertEqual(self.stats.get("files"), 2)
+        self.assertEqual(self.stats.get("bytes"), 10)
+
+    def test_get_missing_counter_is_zero(self):
+        self.assertEqual(self.stats.get("missing"), 0)
+
+    def test_reset(self):
+        self.stats.count("files")
+        self.stats.reset()
+        self.assertEqual(self.stats.get("files"), 0)
+        self.assertEqual(self.stats.summary(), "")
+
+    def test_summary(self):
+        self.stats.count("files", 3)
+        self.stats.count("files_fast_path", 2)
+        self.assertEqual(self.stats.summary(), "files = 3, files_fast_path = 2")
@@ -0,0 +1,182 @@
+# MIT License
+
+# Copyright (c) 2024 sobolxxx
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import unittest
+import os
+import tempfile
+import shutil
+from src.watch import InotifyWatcher, PollingWatcher, coalesce, CHANGED, REMOVED
+from src.path_filter import PathFilter
+from src.log import log
+
+
+
+class TestCoalesce(unittest.TestCase):
+    def test_only_last_event_of_path_is_kept(self):
+        events = [(CHANGED, "a"), (CHANGED, "b"), (REMOVED, "a"), (CHANGED, "b"), (CHANGED, "a")]
+        self.assertEqual(coalesce(events), [(CHANGED, "b"), (CHANGED, "a")])
+
+
+
+class TestInotifyWatcher(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.test_dir, "sub"))
+        os.makedirs(os.path.join(self.test_dir, "out"))
+        self.watcher = InotifyWatcher(self.test_dir, [os.path.join(self.test_dir, "out")])
+
+
+    def tearDown(self):
+        self.watcher.close()
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, *path):
+        with open(os.path.join(self.test_dir, *path), 'w') as f:
+            f.write("content")
+
+
+    def read_all_events(self):
+        events = []
+        new_events = self.watcher.read_events(timeout = 1)
+        while new_events:
+            events.extend(new_events)
+            new_events = self.watcher.read_events(timeout = 0.1)
+        return coalesce(events)
+
+
+    def test_written_file_is_reported(self):
+        self.write("sub", "file.txt")
+        self.assertEqual(self.read_all_events(), [(CHANGED, os.path.join(self.test_dir, "sub", "file.txt"))])
+
+
+    def test_removed_file_is_reported(self):
+        self.write("file.txt")
+        self.read_all_events()
+        os.remove(os.path.join(self.test_dir, "file.txt"))
+        self.assertEqual(self.read_all_events(), [(REMOVED, os.path.join(self.test_dir, "file.txt"))])
+
+
+    def test_file_moved_into_tree_is_reported(self):
+        outside = tempfile.mkdtemp(dir=self.test_dir + "/..")
+        try:
+            with open(os.path.join(outside, "moved.txt"), 'w') as f:
+                f.write("content")
+            os.rename(os.path.join(outside, "moved.txt"), os.path.join(self.test_dir, "moved.txt"))
+        finally:
+            shutil.rmtree(outside)
+        self.assertEqual(self.read_all_events(), [(CHANGED, os.path.join(self.test_dir, "moved.txt"))])
+
+
+    def test_new_directory_is_watched(self):
+        os.makedirs(os.path.join(self.test_dir, "new", "deep"))
+        self.read_all_events()
+        self.write("new", "deep", "file.txt")
+        self.assertIn((CHANGED, os.path.join(self.test_dir, "new", "deep", "file.txt")), self.read_all_events())
+
+
+    def test_excluded_directory_is_not_watched(self):
+        self.write("out", "file.txt")
+        self.assertEqual(self.read_all_events(), [])
+
+
+    def test_directories_excluded_by_path_filter_are_not_watched(self):
+        os.makedirs(os.path.join(self.test_dir, "node_modules", "lib"))
+        self.watcher.close()
+        self.watcher = InotifyWatcher(self.test_dir, [], PathFilter(exclude = ["node_modules/"]))
+        self.assertEqual(sorted(self.watcher.directories.values()),
+                         sorted([self.test_dir, os.path.join(self.test_dir, "sub"), os.path.join(self.test_dir, "out")]))
+        os.makedirs(os.path.join(self.test_dir, "sub", "node_modules"))
+        self.read_all_events()
+        self.assertNotIn(os.path.join(self.test_dir, "sub", "node_modules"), self.watcher.directories.values())
+
+
+
+class TestPollingWatcher(unittest.TestCase):
+    def setUp(self):
+        log.setSilent(True)
+        self.test_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.test_dir, "sub"))
+        os.makedirs(os.path.join(self.test_dir, "out"))
+        self.write("sub", "existing.txt")
+        self.watcher = PollingWatcher(self.test_dir, [os.path.join(self.test_dir, "out")], interval = 0.01)
+
+
+    def tearDown(self):
+        self.watcher.close()
+        log.setSilent(False)
+        shutil.rmtree(self.test_dir)
+
+
+    def write(self, *path, content = "content"):
+        with open(os.path.join(self.test_dir, *path), 'w') as f:
+            f.write(content)
+
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.watcher.read_events(timeout = 1), [])
+
+
+    def test_created_and_removed_files_are_reported(self):
+        self.write("sub", "file.txt")
+        os.remove(os.path.join(self.test_dir, "sub", "existing.txt"))
+        self.assertEqual(sorted(self.watcher.poll()), [(CHANGED, os.path.join(self.test_dir, "sub", "file.txt")),
+                                                       (REMOVED, os.path.join(self.test_dir, "sub", "existing.txt"))])
+
+
+    def test_file_modified_in_place_is_reported_on_full_scan(self):
+        self.watcher.full_scan_every = 2
+        self.write("sub", "existing.txt", content = "longer content")
+        self.assertEqual(self.watcher.poll(), [])
+        self.assertEqual(self.watcher.poll(), [(CHANGED, os.path.join(self.test_dir, "sub", "existing.txt"))])
+
+
+    def test_new_directory_is_scanned(self):
+        os.makedirs(os.path.join(self.test_dir, "new", "deeper"))
+        self.write("new", "deeper", "file.txt")
+        self.assertEqual(self.watcher.poll(), [(CHANGED, os.path.join(self.test_dir, "new", "deeper", "file.txt"))])
+        self.write("new", "deeper", "second.txt")
+        self.assertEqual(self.watcher.poll(), [(CHANGED, os.path.join(self.test_dir, "new", "deeper", "second.txt"))])
+
+
+    def test_removed_directory_is_forgotten(self):
+        shutil.rmtree(os.path.join(self.test_dir, "sub"))
+        self.assertEqual(self.watcher.poll(), [(REMOVED, os.path.join(self.test_dir, "sub"))])
+        self.assertNotIn(os.path.join(self.test_dir, "sub"), self.watcher.directories)
+
+
+    def test_excluded_directory_is_not_watched(self):
+        self.write("out", "file.txt")
+        self.assertEqual(self.watcher.poll(), [])
+
+
+    def test_directories_excluded_by_path_filter_are_not_listed(self):
+        os.makedirs(os.path.join(self.test_dir, "sub", "node_modules"))
+        self.write("sub", "node_modules", "lib.js")
+        watcher = PollingWatcher(self.test_dir, [], interval = 0.01, path_filter = PathFilter(exclude = ["node_modules/"]))
+        self.assertNotIn(os.path.join(self.test_dir, "sub", "node_modules"), watcher.directories)
+        os.makedirs(os.path.join(self.test_dir, "node_modules"))
+        self.write("node_modules", "new.js")
+        self.assertEqual(watcher.poll(), [])